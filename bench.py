@@ -1,42 +1,139 @@
 #!/usr/bin/env python3
 
 import os
+import sys
 import threading
 import time
 
 from calculations import *
 from logg import logger, setup_logging
-from k8s import capture_logs
+from k8s import capture_logs, validate_capture_backend, discover_pods, resolve_node_addresses
+from k8s_client import get_connection_pool_stats
 from cleanup import clean_logs
-from hw import run_hw_metrics
-from deployment_processing import process_and_write_results
+from hw import run_hw_metrics, run_hw_metrics_on_nodes
+from deployment_processing import LiveMetrics, process_and_write_results, available_cpus
+from log_sink import validate_compression
+from sweep import run_capacity_sweep
+from rolling import run_daemon
+from readiness import wait_for_steady_state
+from result_store import new_run_id
+from regression import compare_run, log_verdict, write_verdict, FAIL
+from telemetry import increment, set_profiling, validate_telemetry_format, write_telemetry, write_profile, check_capture_health
 
 DEPLOYMENTS = ["rmd", "ids", "ptd", "tfa", "fds", "sfds", "snfds", "tds", "aod", "frs"]
 LOG_DIR = "/var/log/scylla/bench"
 SINGLE_RESULT_FILE_PATH = os.path.join(LOG_DIR, "single_results.csv")
 COMBO_RESULT_FILE_PATH = os.path.join(LOG_DIR, "combo_results.csv")
-DEPLOYMENT_CONDITION_TIMEOUT = 120
+STATISTICS_RESULT_FILE_PATH = os.path.join(LOG_DIR, "metric_statistics.csv")
+HARDWARE_RESULT_FILE_PATH = os.path.join(LOG_DIR, "hardware_results.csv")
+WINDOW_RESULT_FILE_PATH = os.path.join(LOG_DIR, "window_results.csv")
+CAPACITY_RESULT_FILE_PATH = os.path.join(LOG_DIR, "capacity_results.csv")
+RESULTS_DB_PATH = os.getenv('RESULTS_DB_PATH', os.path.join(LOG_DIR, "results.db"))
+REGRESSION_VERDICT_FILE_PATH = os.path.join(LOG_DIR, "regression_verdict.json")
 
 DURATION = int(os.getenv('DURATION', 60))
 REMOTE_USER = os.getenv('REMOTE_USER', "scylla")
 REMOTE_IP = os.getenv('REMOTE_IP', "192.168.11.203")
 SSH_PASSWORD = os.getenv('SSH_PASSWORD', "$cy11a")
 INFINITE_TIMEOUT = os.getenv('INFINITE_TIMEOUT', 'false').lower() == 'true'
+MAX_CONCURRENT_CAPTURES = int(os.getenv('MAX_CONCURRENT_CAPTURES', 0)) or None
+STREAM_METRICS = os.getenv('STREAM_METRICS', 'true').lower() == 'true'
+# Streamed metrics do not need the raw logs, so they are only written when asked for or parsed afterwards.
+WRITE_RAW_LOGS = os.getenv('WRITE_RAW_LOGS', 'false').lower() == 'true' or not STREAM_METRICS
+LOG_COMPRESSION = os.getenv('LOG_COMPRESSION', '').lower() or None
+CAPTURE_BACKEND = os.getenv('CAPTURE_BACKEND', 'api').lower()
+PROCESSING_WORKERS = int(os.getenv('PROCESSING_WORKERS', 0)) or available_cpus()
+HW_NODE_DISCOVERY = os.getenv('HW_NODE_DISCOVERY', 'true').lower() == 'true'
+DEPLOYMENT_CONDITION_TIMEOUT = int(os.getenv('DEPLOYMENT_CONDITION_TIMEOUT', 120))
+READINESS_GATE = os.getenv('READINESS_GATE', 'true').lower() == 'true'
+READINESS_WARMUP_SECONDS = float(os.getenv('READINESS_WARMUP_SECONDS', 10))
+READINESS_MARKER = os.getenv('READINESS_MARKER') or None
+BENCH_MODE = os.getenv('BENCH_MODE', 'daemon' if INFINITE_TIMEOUT else 'window').lower()
+BENCH_MODES = ("window", "sweep", "daemon")
+DAEMON_WINDOW_SECONDS = int(os.getenv('DAEMON_WINDOW_SECONDS', 60))
+DAEMON_STEP_SECONDS = int(os.getenv('DAEMON_STEP_SECONDS', DAEMON_WINDOW_SECONDS))
+DAEMON_HOST = os.getenv('DAEMON_HOST', "127.0.0.1")
+DAEMON_PORT = int(os.getenv('DAEMON_PORT', 8080))
+SWEEP_NAMESPACE = os.getenv('SWEEP_NAMESPACE', "fds")
+SWEEP_DEPLOYMENT = os.getenv('SWEEP_DEPLOYMENT') or None
+SWEEP_CONTAINER = os.getenv('SWEEP_CONTAINER') or None
+SWEEP_PARAMETER = os.getenv('SWEEP_PARAMETER', "replicas")
+SWEEP_MIN = int(os.getenv('SWEEP_MIN', 1))
+SWEEP_MAX = int(os.getenv('SWEEP_MAX', 16))
+SWEEP_STRATEGY = os.getenv('SWEEP_STRATEGY', 'binary').lower()
+SWEEP_STEP = int(os.getenv('SWEEP_STEP', 1))
+SWEEP_MAX_QUEUE_SIZE = float(os.getenv('SWEEP_MAX_QUEUE_SIZE')) if os.getenv('SWEEP_MAX_QUEUE_SIZE') else None
+SWEEP_MIN_FPS = float(os.getenv('SWEEP_MIN_FPS')) if os.getenv('SWEEP_MIN_FPS') else None
+SWEEP_MAX_LOAD = float(os.getenv('SWEEP_MAX_LOAD')) if os.getenv('SWEEP_MAX_LOAD') else None
+SWEEP_MAX_QUEUE_GROWTH = float(os.getenv('SWEEP_MAX_QUEUE_GROWTH')) if os.getenv('SWEEP_MAX_QUEUE_GROWTH') else None
+REGRESSION_BASELINE_RUNS = int(os.getenv('REGRESSION_BASELINE_RUNS', 5))
+REGRESSION_CONFIDENCE = float(os.getenv('REGRESSION_CONFIDENCE', 0.95))
+REGRESSION_THRESHOLD = float(os.getenv('REGRESSION_THRESHOLD', 0.05))
+REGRESSION_GATE = os.getenv('REGRESSION_GATE', 'false').lower() == 'true'
+REGRESSION_EXIT_CODE = 3
+TELEMETRY_FORMAT = os.getenv('TELEMETRY_FORMAT', 'json').lower()
+TELEMETRY_FILE_PATH = os.path.join(LOG_DIR, "telemetry.prom" if TELEMETRY_FORMAT == "prometheus" else "telemetry.json")
+CAPTURE_LAG_WARNING_SECONDS = float(os.getenv('CAPTURE_LAG_WARNING_SECONDS', 5))
+PROFILE = os.getenv('PROFILE', 'false').lower() == 'true'
+PROFILE_FILE_PATH = os.path.join(LOG_DIR, "profile.pstats")
+
+def validate_bench_mode(bench_mode):
+    if bench_mode not in BENCH_MODES:
+        raise ValueError(f"Invalid bench mode: {bench_mode}")
+
 
 def main():
     try:
         clean_logs(LOG_DIR)
         setup_logging()
+        validate_bench_mode(BENCH_MODE)
+        validate_compression(LOG_COMPRESSION)
+        validate_capture_backend(CAPTURE_BACKEND)
+        validate_telemetry_format(TELEMETRY_FORMAT)
+        set_profiling(PROFILE)
+
+        if BENCH_MODE == "sweep":
+            logger.info(f"Starting capacity sweep of {SWEEP_PARAMETER} in {SWEEP_NAMESPACE} from {SWEEP_MIN} to {SWEEP_MAX}.")
+            run_capacity_sweep(SWEEP_NAMESPACE, SWEEP_PARAMETER, SWEEP_MIN, SWEEP_MAX, DURATION, LOG_DIR,
+                               CAPACITY_RESULT_FILE_PATH, DEPLOYMENT_CONDITION_TIMEOUT, SWEEP_DEPLOYMENT, SWEEP_CONTAINER,
+                               SWEEP_MAX_QUEUE_SIZE, SWEEP_MIN_FPS, SWEEP_MAX_LOAD, SWEEP_STRATEGY, SWEEP_STEP,
+                               READINESS_WARMUP_SECONDS, READINESS_MARKER, CAPTURE_BACKEND, SWEEP_MAX_QUEUE_GROWTH)
+            return
+
+        if READINESS_GATE:
+            wait_for_steady_state(DEPLOYMENTS, DEPLOYMENT_CONDITION_TIMEOUT, READINESS_WARMUP_SECONDS, READINESS_MARKER)
+
+        if BENCH_MODE == "daemon":
+            logger.info(f"Starting continuous benchmarking with {DAEMON_WINDOW_SECONDS}s windows.")
+            run_daemon(DEPLOYMENTS, LOG_DIR, DAEMON_WINDOW_SECONDS, DAEMON_STEP_SECONDS, DAEMON_HOST, DAEMON_PORT,
+                       REMOTE_USER, REMOTE_IP, SSH_PASSWORD, HW_NODE_DISCOVERY, CAPTURE_BACKEND)
+            return
 
-        logger.info(f"Starting benchmarking for {DURATION} seconds.")
+        run_info = {"run_id": new_run_id(), "started_at": time.time(), "duration": DURATION, "mode": BENCH_MODE,
+                    "deployments": DEPLOYMENTS}
+        logger.info(f"Starting benchmarking run {run_info['run_id']} for {DURATION} seconds.")
+
+        live_metrics = LiveMetrics() if STREAM_METRICS else None
+
+        pod_nodes, pod_images = discover_pods(DEPLOYMENTS)
+        if not HW_NODE_DISCOVERY:
+            pod_nodes = {}
+        node_addresses = resolve_node_addresses(set(pod_nodes.values()))
+        if node_addresses:
+            logger.info(f"Collecting hardware metrics from nodes: {node_addresses}")
+            hw_thread = threading.Thread(target=run_hw_metrics_on_nodes, args=(LOG_DIR, DURATION, node_addresses, REMOTE_USER, SSH_PASSWORD))
+        else:
+            pod_nodes = {}
+            hw_thread = threading.Thread(target=run_hw_metrics, args=(LOG_DIR, DURATION, REMOTE_USER, REMOTE_IP, SSH_PASSWORD))
 
         threads = []
         for deployment in DEPLOYMENTS:
-            log_thread = threading.Thread(target=capture_logs, args=(deployment, DURATION, LOG_DIR))
+            log_thread = threading.Thread(target=capture_logs, args=(deployment, DURATION, LOG_DIR, MAX_CONCURRENT_CAPTURES,
+                                                                     live_metrics, WRITE_RAW_LOGS, LOG_COMPRESSION, None,
+                                                                     CAPTURE_BACKEND))
             log_thread.start()
             threads.append(log_thread)
 
-        hw_thread = threading.Thread(target=run_hw_metrics, args=(LOG_DIR, DURATION, REMOTE_USER, REMOTE_IP, SSH_PASSWORD))
         hw_thread.start()
         threads.append(hw_thread)
 
@@ -44,18 +141,35 @@ def main():
             thread.join()
 
         logger.info("Hardware metrics collection completed.")
+        pool_stats = get_connection_pool_stats()
+        logger.info(f"Kubernetes API connection pool stats: {pool_stats}")
+        for event, count in pool_stats.items():
+            increment("api_pool_events_total", count, event=event)
         logger.debug("Processing pod metrics.")
-        process_and_write_results(LOG_DIR, DEPLOYMENTS, SINGLE_RESULT_FILE_PATH, COMBO_RESULT_FILE_PATH)
+        process_and_write_results(LOG_DIR, DEPLOYMENTS, SINGLE_RESULT_FILE_PATH, COMBO_RESULT_FILE_PATH, live_metrics,
+                                  STATISTICS_RESULT_FILE_PATH, PROCESSING_WORKERS, pod_nodes, HARDWARE_RESULT_FILE_PATH,
+                                  WINDOW_RESULT_FILE_PATH, RESULTS_DB_PATH, run_info, pod_images)
+
+        check_capture_health(write_telemetry(TELEMETRY_FILE_PATH, TELEMETRY_FORMAT), CAPTURE_LAG_WARNING_SECONDS)
+        logger.info(f"Telemetry written to {TELEMETRY_FILE_PATH}")
+        if PROFILE and write_profile(PROFILE_FILE_PATH):
+            logger.info(f"Profile written to {PROFILE_FILE_PATH}")
+
+        exit_code = 0
+        if REGRESSION_BASELINE_RUNS > 0:
+            verdict = compare_run(RESULTS_DB_PATH, run_info["run_id"], REGRESSION_BASELINE_RUNS, REGRESSION_CONFIDENCE,
+                                  REGRESSION_THRESHOLD)
+            log_verdict(verdict)
+            write_verdict(REGRESSION_VERDICT_FILE_PATH, verdict)
+            if REGRESSION_GATE and verdict["verdict"] == FAIL:
+                exit_code = REGRESSION_EXIT_CODE
 
-        if INFINITE_TIMEOUT:
-            logger.info("Running with infinite timeout. Script will not terminate.")
-            while True:
-                time.sleep(10)
+        return exit_code
 
     finally:
         logger.info("Cleaning up.")
         clean_logs(LOG_DIR)
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
 
@@ -1,68 +1,410 @@
 #!/usr/bin/env python3
 
+import os
 import re
+import copy
 import json
+import calendar
+import time
+from functools import lru_cache
 
 from logg import logger
+from log_sink import open_log_file
+from timeseries import TimeSeries
 
 NS_STEP = 10
+NS_RANGES = 20
+SERVER_LOAD_PATTERN = re.compile(r"Server load of inference (\d*)%")
 
+WARMUP_SAMPLES = int(os.environ['WARMUP_SAMPLES']) if os.getenv('WARMUP_SAMPLES') else None
+WARMUP_SECONDS = float(os.getenv('WARMUP_SECONDS', 0))
 
-def read_file_lines(file_path):
+CAMERA_NUMBER_PATTERNS = {
+    'ptd': re.compile(r'Number of cameras: (\d+)'),
+    'rmd': re.compile(r'Number of cameras: (\d+)'),
+    'aod': re.compile(r'Number of cameras: (\d+)'),
+    'fds': re.compile(r'Total number of cameras:(\d+)'),
+    'snfds': re.compile(r'Total number of cameras:(\d+)'),
+    'sfds': re.compile(r'Total number of cameras:(\d+)'),
+    'tds': re.compile(r'Total number of cameras:(\d+)'),
+    'ids': re.compile(r'Batch size: (\d+)'),
+    'tfa': re.compile(r'Batch size: (\d+)'),
+}
+CAMERA_NUMBER_MULTIPLIERS = {'tfa': 2}
+
+
+class LogMetric:
+    name = None
+    log_source = "pod"
+
+    def __init__(self, source="", continuation=False):
+        self.source = source
+        self.continuation = continuation
+        self.failed = False
+
+    def feed(self, line, timestamp=None):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+    def merge(self, other):
+        raise NotImplementedError
+
+    def concat(self, other):
+        self.merge(other)
+
+    def stats(self):
+        return None
+
+
+class TimeSeriesMetric(LogMetric):
+    warmup_samples = 0
+
+    def __init__(self, source="", continuation=False):
+        super().__init__(source, continuation)
+        warmup_samples = self.warmup_samples if WARMUP_SAMPLES is None else WARMUP_SAMPLES
+        self.series = TimeSeries(warmup_samples, WARMUP_SECONDS, continuation)
+
+    def merge(self, other):
+        self.series.merge(other.series)
+
+    def concat(self, other):
+        self.series.extend(other.series)
+
+    def stats(self):
+        return self.series.summary()
+
+
+class AverageLoad(TimeSeriesMetric):
+    name = "calculate_average_load"
+    pattern = re.compile(r'(\d+)%')
+    # Any percentage is read as a load sample, but only the server's own load line shows it is processing.
+    steady_state_pattern = SERVER_LOAD_PATTERN
+    # The first reported load covers model start-up and is left out by default.
+    warmup_samples = 1
+
+    def feed(self, line, timestamp=None):
+        if '%' not in line:
+            return
+        match = self.pattern.search(line)
+        if match:
+            self.series.add(int(match.group(1)), timestamp)
+
+    def result(self):
+        if not self.series:
+            if self.series.skipped:
+                return "Only one server load present, no average to calculate."
+            logger.error(f'No server load data found in {self.source}')
+            return "error"
+        return f"{round(self.series.mean(), 2)}% ({len(self.series)})"
+
+
+class IdsMotion(LogMetric):
+    name = "calculate_ids_motion"
+    log_source = "info"
+    pattern = re.compile(r'\[.*\] Number of motion alerts from camera: \[(.*?)\](\d+)')
+
+    def __init__(self, source="", continuation=False):
+        super().__init__(source, continuation)
+        self.camera_data = {}
+
+    def feed(self, line, timestamp=None):
+        if 'Number of motion alerts' not in line:
+            return
+        match = self.pattern.search(line)
+        if match:
+            camera, count = match.groups()
+            totals = self.camera_data.setdefault(camera, [0, 0])
+            totals[0] += int(count)
+            totals[1] += 1
+
+    def merge(self, other):
+        for camera, (total, count) in other.camera_data.items():
+            totals = self.camera_data.setdefault(camera, [0, 0])
+            totals[0] += total
+            totals[1] += count
+
+    def result(self):
+        if not self.camera_data:
+            logger.debug(f"No motion data found in file {self.source}")
+            return None
+
+        sum_of_averages = sum(total / count for total, count in self.camera_data.values())
+        return round(sum_of_averages)
+
+
+class NumSamples(LogMetric):
+    name = "calculate_num_samples"
+    load_pattern = SERVER_LOAD_PATTERN
+    sample_pattern = re.compile(r"Num samples: (\d+)")
+
+    def __init__(self, source="", continuation=False):
+        super().__init__(source, continuation)
+        self.num_samples_sum = 0
+        self.num_samples_count = 0
+        self.ranges = {}
+        # A continuation cannot see the samples that preceded its first load line, so it
+        # keeps them apart and lets concat() resolve that line.
+        self.seen_load = False
+        self.first_load = None
+        self.leading_sum = 0
+        self.leading_count = 0
+
+    def record(self, num_samples_avg, load):
+        i = int(num_samples_avg // NS_STEP)
+        if 0 <= i < NS_RANGES:
+            totals = self.ranges.setdefault(f"{i*NS_STEP} - {(i+1)*NS_STEP}", [0, 0])
+            totals[0] += load
+            totals[1] += 1
+
+    def feed(self, line, timestamp=None):
+        if 'Server load of inference' in line:
+            match = self.load_pattern.search(line)
+            if match and self.continuation and not self.seen_load:
+                self.first_load = int(match.group(1))
+                self.leading_sum = self.num_samples_sum
+                self.leading_count = self.num_samples_count
+                self.num_samples_sum = 0
+                self.num_samples_count = 0
+            elif match and self.num_samples_count > 0:
+                self.record(self.num_samples_sum / self.num_samples_count, int(match.group(1)))
+                self.num_samples_sum = 0
+                self.num_samples_count = 0
+            if match:
+                self.seen_load = True
+
+        if 'Num samples:' in line:
+            match = self.sample_pattern.search(line)
+            if match:
+                self.num_samples_sum += float(match.group(1))
+                self.num_samples_count += 1
+
+    def merge(self, other):
+        for range_key, (total, count) in other.ranges.items():
+            totals = self.ranges.setdefault(range_key, [0, 0])
+            totals[0] += total
+            totals[1] += count
+
+    def concat(self, other):
+        if not other.seen_load:
+            self.num_samples_sum += other.num_samples_sum
+            self.num_samples_count += other.num_samples_count
+            return
+
+        pending_count = self.num_samples_count + other.leading_count
+        if other.first_load is not None and pending_count > 0:
+            self.record((self.num_samples_sum + other.leading_sum) / pending_count, other.first_load)
+        self.merge(other)
+        self.num_samples_sum = other.num_samples_sum
+        self.num_samples_count = other.num_samples_count
+        self.seen_load = True
+
+    def result(self):
+        formatted_results = {range_key: f"{total / count:.2f}% ({count})"
+                             for range_key, (total, count) in self.ranges.items()}
+        return json.dumps(formatted_results, indent=2)
+
+
+class QueueSize(TimeSeriesMetric):
+    name = "calculate_queue_size"
+    pattern = re.compile(r'Inference queue size: (\d+(?:\.\d+)?)')
+
+    def feed(self, line, timestamp=None):
+        if 'Inference queue size' not in line:
+            return
+        match = self.pattern.search(line)
+        if match:
+            self.series.add(float(match.group(1)), timestamp)
+
+    def result(self):
+        if not self.series:
+            logger.error(f'No queue size data found in {self.source}')
+            return "error"
+        return f"{self.series.mean()} ({len(self.series)})"
+
+
+class Fps(TimeSeriesMetric):
+    name = "calculate_fps"
+    pattern = re.compile(r'FPS:(\d+\.\d+)')
+
+    def feed(self, line, timestamp=None):
+        if 'FPS:' not in line:
+            return
+        match = self.pattern.search(line)
+        if match:
+            self.series.add(float(match.group(1)), timestamp)
+
+    def result(self):
+        if not self.series:
+            logger.error(f'No FPS data found in {self.source}')
+            return "error"
+        return f"{self.series.mean()} ({len(self.series)})"
+
+
+class CameraNumber(LogMetric):
+    name = "camera_number"
+
+    def __init__(self, deployment_type, source="", continuation=False):
+        super().__init__(source, continuation)
+        self.deployment_type = deployment_type
+        self.pattern = CAMERA_NUMBER_PATTERNS.get(deployment_type)
+        self.camera_number = None
+
+    def feed(self, line, timestamp=None):
+        if self.camera_number is not None or self.pattern is None:
+            return
+        match = self.pattern.search(line)
+        if match:
+            self.camera_number = str(int(match.group(1)) * CAMERA_NUMBER_MULTIPLIERS.get(self.deployment_type, 1))
+
+    def merge(self, other):
+        # Replicas split the cameras between them, so the deployment serves their sum.
+        if other.camera_number is not None:
+            self.camera_number = str(int(self.camera_number or 0) + int(other.camera_number))
+
+    def concat(self, other):
+        if self.camera_number is None:
+            self.camera_number = other.camera_number
+
+    def result(self):
+        return self.camera_number
+
+
+@lru_cache(maxsize=4096)
+def parse_log_seconds(value):
+    return calendar.timegm(time.strptime(value, '%Y-%m-%dT%H:%M:%S'))
+
+
+def parse_log_timestamp(value):
+    # Kubernetes prefixes lines with RFC 3339 timestamps, e.g. 2024-05-01T12:00:00.123456789Z; container
+    # runtimes may write node log files with a local offset such as +02:00 instead of Z.
+    offset = 0
+    if value.endswith('Z'):
+        value = value[:-1]
+    elif len(value) > 19 and value[-6] in '+-' and value[-3] == ':':
+        offset = (int(value[-5:-3]) * 3600 + int(value[-2:]) * 60) * (1 if value[-6] == '+' else -1)
+        value = value[:-6]
+    seconds, _, fraction = value.partition('.')
+    timestamp = parse_log_seconds(seconds) - offset
+    return timestamp + float('0.' + fraction) if fraction else float(timestamp)
+
+
+def split_log_timestamp(line):
+    if len(line) < 20 or line[4] != '-' or line[10] != 'T':
+        return None, line
+    value, _, text = line.partition(' ')
     try:
-        with open(file_path, 'r') as file:
-            return file.readlines()
+        return parse_log_timestamp(value), text
+    except ValueError:
+        return None, line
+
+
+def parse_log_file(log_file_path, metrics):
+    try:
+        with open_log_file(log_file_path) as file:
+            feed_timestamped_lines(file, metrics)
+        return True
     except FileNotFoundError:
-        logger.error(f"File '{file_path}' not found.")
+        logger.error(f"File '{log_file_path}' not found.")
+    except IOError as io_err:
+        logger.error(f"I/O error reading file '{log_file_path}': {io_err}")
+    except Exception as e:
+        logger.error(f"Unexpected error processing file '{log_file_path}': {e}")
+
+    for metric in metrics:
+        metric.failed = True
+    return False
+
+
+def merge_metrics(metric_lists):
+    merged = {}
+    for metrics in metric_lists:
+        for metric in metrics:
+            if metric.name not in merged:
+                merged[metric.name] = copy.deepcopy(metric)
+            else:
+                merged[metric.name].merge(metric)
+                merged[metric.name].failed = merged[metric.name].failed and metric.failed
+    return list(merged.values())
+
+
+def concat_metrics(metric_lists):
+    combined = {}
+    for metrics in metric_lists:
+        for metric in metrics:
+            if metric.name not in combined:
+                combined[metric.name] = metric
+            else:
+                combined[metric.name].concat(metric)
+                combined[metric.name].failed = combined[metric.name].failed or metric.failed
+    return list(combined.values())
+
+
+def find_chunk_boundaries(log_file_path, chunk_bytes):
+    size = os.path.getsize(log_file_path)
+    boundaries = [0]
+    with open(log_file_path, 'rb') as file:
+        while boundaries[-1] + chunk_bytes < size:
+            file.seek(boundaries[-1] + chunk_bytes)
+            file.readline()
+            if file.tell() >= size:
+                break
+            boundaries.append(file.tell())
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def parse_log_chunk(log_file_path, start, end, metrics):
+    try:
+        with open(log_file_path, 'rb') as file:
+            file.seek(start)
+            position = start
+            for raw_line in file:
+                if position >= end:
+                    break
+                position += len(raw_line)
+                timestamp, line = split_log_timestamp(raw_line.decode('utf-8', errors='replace'))
+                for metric in metrics:
+                    metric.feed(line, timestamp)
+        return True
     except IOError as io_err:
-        logger.error(f"I/O error reading file '{file_path}': {io_err}")
+        logger.error(f"I/O error reading bytes {start}-{end} of '{log_file_path}': {io_err}")
     except Exception as e:
-        logger.error(f"Unexpected error processing file '{file_path}': {e}")
-    return None
+        logger.error(f"Unexpected error processing bytes {start}-{end} of '{log_file_path}': {e}")
 
+    for metric in metrics:
+        metric.failed = True
+    return False
 
-def calculate_average_load(log_file_path):
-    logger.debug(f"Calculating average load for {log_file_path}")
-    lines = read_file_lines(log_file_path)
-
-    server_loads = [int(re.sub('%', '', m.group(0))) for line in lines if (m := re.search(r'\d*%', line))]
-
-    if server_loads:
-        if len(server_loads) > 1:
-            average_server_load = sum(server_loads[1:]) / len(server_loads[1:])
-        else:
-            return "Only one server load present, no average to calculate."
-        
-        return f"{round(average_server_load, 2)}% ({len(server_loads)-1})"
-    else:
-        logger.error(f'No server load data found in {log_file_path}')
-        return "error"
-    
 
-def calculate_ids_motion(info_log_file):
-    logger.debug(f"Calculating motion count for {info_log_file}")
+def feed_lines(lines, metrics, timestamp=None):
+    for line in lines:
+        for metric in metrics:
+            metric.feed(line, timestamp)
 
-    lines = read_file_lines(info_log_file)
-    if lines is None:
+
+def feed_timestamped_lines(lines, metrics):
+    for line in lines:
+        timestamp, line = split_log_timestamp(line)
+        for metric in metrics:
+            metric.feed(line, timestamp)
+
+
+def calculate_metric(log_file_path, metric):
+    if not parse_log_file(log_file_path, [metric]):
         return "error"
+    return metric.result()
 
-    pattern = re.compile(r'\[.*\] Number of motion alerts from camera: \[(.*?)\](\d+)')
-    camera_data = {}
 
-    for line in lines:
-        match = pattern.search(line)
-        if match:
-            camera, count = match.groups()
-            count = int(count)
-            camera_data.setdefault(camera, []).append(count)
+def calculate_average_load(log_file_path):
+    logger.debug(f"Calculating average load for {log_file_path}")
+    return calculate_metric(log_file_path, AverageLoad(log_file_path))
 
-    if not camera_data:
-        logger.debug(f"No motion data found in file {info_log_file}")
-        return None
 
-    averages = {camera: sum(counts) / len(counts) for camera, counts in camera_data.items()}
-    sum_of_averages = sum(averages.values())
-    return round(sum_of_averages)
+def calculate_ids_motion(info_log_file):
+    logger.debug(f"Calculating motion count for {info_log_file}")
+    return calculate_metric(info_log_file, IdsMotion(info_log_file))
 
 
 def sort_num_samples(hash_map) -> dict:
@@ -84,94 +426,23 @@ def sort_num_samples(hash_map) -> dict:
 
 def calculate_num_samples(log_file_path):
     logger.debug(f"Calculating number of samples for {log_file_path}")
-    
-    lines = read_file_lines(log_file_path)
-    if lines is None:
-        return "error"
-
-    results = {"num_samples": {}}
-    num_samples_sum = 0
-    num_samples_count = 0
-    load_pattern = re.compile(r"Server load of inference (\d*)%")
-    sample_pattern = re.compile("Num samples:.\d*")
-
-    for line in lines:
-        temp_search = load_pattern.search(line.strip())
-        if temp_search:
-            temp_value = int(temp_search.group(1))
-            if num_samples_count > 0:
-                num_samples_chunk_avg = num_samples_sum / num_samples_count
-                num_samples_sum = 0
-                num_samples_count = 0
-
-                for i in range(0, 20):
-                    if i * NS_STEP <= num_samples_chunk_avg < (i + 1) * NS_STEP:
-                        range_key = f"{i*NS_STEP} - {(i+1)*NS_STEP}"
-                        results["num_samples"].setdefault(range_key, []).append(temp_value)
-
-        temp_search = sample_pattern.search(line.strip())
-        if temp_search:
-            temp_search_num = float(temp_search.group().split(": ")[1])
-            num_samples_sum += temp_search_num
-            num_samples_count += 1
-
-    formatted_results = {range_key: f"{sum(load_values) / len(load_values):.2f}% ({len(load_values)})"
-                         for range_key, load_values in results["num_samples"].items()}
-
-    return json.dumps(formatted_results, indent=2)
+    return calculate_metric(log_file_path, NumSamples(log_file_path))
 
 
 def calculate_queue_size(log_file_path):
     logger.debug(f"Calculating queue size for {log_file_path}")
-    lines = read_file_lines(log_file_path)
-    if lines is None:
-        return "error"
-
-    queue_sizes = [float(match.group(1)) for line in lines if (match := re.search(r'Inference queue size: (\d+(?:\.\d+)?)', line))]
+    return calculate_metric(log_file_path, QueueSize(log_file_path))
 
-    if queue_sizes:
-        average_queue = sum(queue_sizes) / len(queue_sizes)
-        return f"{average_queue} ({len(queue_sizes)})"
-    else:
-        logger.error(f'No queue size data found in {log_file_path}')
-        return "error"
-    
 
 def calculate_fps(log_file_path):
     logger.debug(f"Calculating FPS for {log_file_path}")
-    lines = read_file_lines(log_file_path)
-    if lines is None:
-        return "error"
-
-    fps_values = [float(match.group(1)) for line in lines if (match := re.search(r'FPS:(\d+\.\d+)', line))]
-
-    if fps_values:
-        average_fps = sum(fps_values) / len(fps_values)
-        return f"{average_fps} ({len(fps_values)})"
-    else:
-        logger.error(f'No FPS data found in {log_file_path}')
-        return "error"
+    return calculate_metric(log_file_path, Fps(log_file_path))
 
 
 def extract_camera_number(logs, deployment_type):
-    camera_number = None
-    
-    if deployment_type in ['ptd', 'rmd', 'aod']:
-        match = re.search(r'Number of cameras: (\d+)', logs)
-        if match:
-            camera_number = match.group(1)
-    elif deployment_type in ['fds', 'snfds', 'sfds', 'tds']:
-        match = re.search(r'Total number of cameras:(\d+)', logs)
-        if match:
-            camera_number = match.group(1)
-    elif deployment_type == 'ids':
-        match = re.search(r'Batch size: (\d+)', logs)
-        if match:
-            camera_number = match.group(1)
-    elif deployment_type == 'tfa':
-        match = re.search(r'Batch size: (\d+)', logs)
-        if match:
-            camera_number = match.group(1)
-            camera_number = camera_number * 2
-
-    return camera_number
+    camera_number = CameraNumber(deployment_type)
+    for line in logs.splitlines():
+        camera_number.feed(line)
+        if camera_number.result() is not None:
+            break
+    return camera_number.result()
@@ -4,13 +4,16 @@ import pathlib
 
 from logg import logger
 
+# Raw pod logs, and hardware samples, which must not be mistaken for the next run's.
+CLEANUP_PATTERNS = ('*.log*', 'hw_samples*.jsonl')
+
 def clean_logs(log_dir_path, pod_name=None):
     log_dir = pathlib.Path(log_dir_path)
     if not log_dir.exists():
         logger.warning(f"{log_dir_path} doesn't exist")
         return
 
-    for log_file in log_dir.glob('*.log'):
+    for log_file in (f for pattern in CLEANUP_PATTERNS for f in log_dir.glob(pattern)):
         if pod_name is None or log_file.name.startswith(pod_name):
             log_file.unlink()
             logger.debug(f"Deleted log file {log_file.name}")
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import os
+import math
+import time
+
+from logg import logger
+from hw import align_hardware_samples, combine_hardware_averages
+
+WINDOW_SECONDS = float(os.getenv('CORRELATION_WINDOW_SECONDS', 10))
+GPU_SATURATION_THRESHOLD = float(os.getenv('GPU_SATURATION_THRESHOLD', 95))
+
+SERIES_COLUMNS = {
+    "calculate_average_load": "load",
+    "calculate_fps": "fps",
+    "calculate_queue_size": "queue_size",
+}
+HARDWARE_COLUMNS = ["cpu", "gpu", "vram", "ram"]
+
+window_header = ["Timestamp", "Deployment Name", "Window Start", "Window End", "Nodes", "Server Load (%)", "FPS",
+                 "Queue Size", "Samples", "CPU (%)", "GPU (%)", "VRAM (MB)", "RAM (GB)", "Saturated"]
+
+
+def bucket_series(series, window_seconds):
+    # The series keeps per-interval sums, which are re-grouped here into windows of window_seconds.
+    buckets = {}
+    for start, mean, count in series.interval_means():
+        totals = buckets.setdefault(math.floor(start / window_seconds) * window_seconds, [0.0, 0])
+        totals[0] += mean * count
+        totals[1] += count
+    return {window: (total / count, count) for window, (total, count) in buckets.items()}
+
+
+def window_pod_metrics(metrics, window_seconds):
+    windows = {}
+    for metric in metrics:
+        column = SERIES_COLUMNS.get(metric.name)
+        if column is None:
+            continue
+        for window, (value, count) in bucket_series(metric.series, window_seconds).items():
+            entry = windows.setdefault(window, {"samples": 0})
+            entry[column] = value
+            entry["samples"] += count
+    return windows
+
+
+def window_hardware(node_samples, nodes, window_seconds):
+    timeline = align_hardware_samples({n: node_samples[n] for n in nodes if n in node_samples}, window_seconds)
+    return {window: combine_hardware_averages(by_node.values()) for window, by_node in timeline.items()}
+
+
+def detect_saturation(windows, gpu_threshold=GPU_SATURATION_THRESHOLD):
+    # A window is saturated when the GPU is pinned and the queue grows or FPS drops compared to the previous window.
+    previous = None
+    for window in sorted(windows):
+        entry = windows[window]
+        gpu = entry.get("gpu")
+        pinned = gpu is not None and gpu >= gpu_threshold
+        saturated = False
+        if pinned and previous is not None:
+            if entry.get("queue_size") is not None and previous.get("queue_size") is not None:
+                saturated = entry["queue_size"] > previous["queue_size"]
+            if entry.get("fps") is not None and previous.get("fps") is not None:
+                saturated = saturated or entry["fps"] < previous["fps"]
+        entry["saturated"] = saturated
+        previous = entry
+    return windows
+
+
+def pearson(xs, ys):
+    pairs = [(x, y) for x, y in zip(xs, ys) if x is not None and y is not None]
+    if len(pairs) < 3:
+        return None
+    mean_x = sum(x for x, _ in pairs) / len(pairs)
+    mean_y = sum(y for _, y in pairs) / len(pairs)
+    covariance = sum((x - mean_x) * (y - mean_y) for x, y in pairs)
+    spread_x = math.sqrt(sum((x - mean_x) ** 2 for x, _ in pairs))
+    spread_y = math.sqrt(sum((y - mean_y) ** 2 for _, y in pairs))
+    if spread_x == 0 or spread_y == 0:
+        return None
+    return covariance / (spread_x * spread_y)
+
+
+def correlate_deployment(metrics, node_samples, nodes, window_seconds=WINDOW_SECONDS, gpu_threshold=GPU_SATURATION_THRESHOLD):
+    windows = window_pod_metrics(metrics, window_seconds)
+    for window, hardware in window_hardware(node_samples, nodes, window_seconds).items():
+        if window in windows:
+            windows[window].update(hardware)
+    return detect_saturation(windows, gpu_threshold)
+
+
+def log_correlation(deployment_name, windows):
+    ordered = [windows[w] for w in sorted(windows)]
+    for column in SERIES_COLUMNS.values():
+        coefficient = pearson([e.get("gpu") for e in ordered], [e.get(column) for e in ordered])
+        if coefficient is not None:
+            logger.info(f"{deployment_name}: correlation of GPU utilisation with {column} over "
+                        f"{len(ordered)} windows is {round(coefficient, 3)}")
+
+    saturated = [w for w in sorted(windows) if windows[w]["saturated"]]
+    if saturated:
+        first = windows[saturated[0]]
+        logger.warning(f"{deployment_name} saturated in {len(saturated)} of {len(windows)} windows, first at "
+                       f"{time.strftime('%H:%M:%S', time.localtime(saturated[0]))} "
+                       f"(load {first.get('load')}, FPS {first.get('fps')}, queue size {first.get('queue_size')}, "
+                       f"GPU {first.get('gpu')}%)")
+
+
+def analyze_windows(deployment_metrics, node_samples, nodes_by_deployment, window_seconds=WINDOW_SECONDS):
+    deployment_windows = {}
+    for deployment_name, metrics in deployment_metrics.items():
+        windows = correlate_deployment(metrics, node_samples, nodes_by_deployment.get(deployment_name, ()), window_seconds)
+        if not windows:
+            logger.debug(f"No timestamped samples to correlate for {deployment_name}")
+            continue
+        log_correlation(deployment_name, windows)
+        deployment_windows[deployment_name] = windows
+    return deployment_windows
@@ -2,173 +2,451 @@
 
 import os
 import time
+import threading
 from glob import glob
 import csv
+import sqlite3
+import logging
+from concurrent.futures import ProcessPoolExecutor
 
 from calculations import *
 from logg import logger
-from hw import parse_hardware_metrics
+from hw import parse_node_hardware_averages, combine_hardware_averages, format_hardware_metrics, load_hardware_samples
+from correlation import analyze_windows, window_header, WINDOW_SECONDS, HARDWARE_COLUMNS
+from result_store import record_run
+from log_sink import strip_log_extension
+from telemetry import timed, profiled
 
 
 deployments_mapping = {
-    'ptd': [calculate_average_load],
-    'ids': [calculate_average_load, calculate_ids_motion],
-    'rmd': [calculate_average_load],
-    'aod': [calculate_average_load],
-    'tfa': [calculate_num_samples],
-    'fds': [calculate_queue_size],
-    'sfds': [calculate_queue_size],
-    'snfds': [calculate_queue_size],
-    'tds': [calculate_queue_size],
-    'frs': [calculate_fps]
+    'ptd': [AverageLoad],
+    'ids': [AverageLoad, IdsMotion],
+    'rmd': [AverageLoad],
+    'aod': [AverageLoad],
+    'tfa': [NumSamples],
+    'fds': [QueueSize],
+    'sfds': [QueueSize],
+    'snfds': [QueueSize],
+    'tds': [QueueSize],
+    'frs': [Fps]
 }
 
 
+ALL_REPLICAS = "*"
+PROCESSING_CHUNK_BYTES = 64 * 1024 * 1024
+CGROUP_CPU_MAX = "/sys/fs/cgroup/cpu.max"
+
+hardware_header = ["Timestamp", "Scope", "Name", "Nodes", "VRAM (MB)", "RAM (GB)", "CPU (%)", "GPU (%)"]
+
+metric_column_titles = {
+    AverageLoad.name: "Server Load (%)",
+    IdsMotion.name: "Motion Count",
+    QueueSize.name: "Queue Size",
+    Fps.name: "FPS",
+    NumSamples.name: "Num Samples",
+}
+
+statistics_columns = ["count", "mean", "stddev", "min", "p50", "p90", "p99", "max", "sample_rate"]
+statistics_header = ["Timestamp", "Deployment Name", "Pod Name", "Metric", "Count", "Mean", "Std Dev", "Min",
+                     "P50", "P90", "P99", "Max", "Sample Rate (/s)"]
+
+
 def write_csv_header(csvwriter, results_file, header):
     if not os.path.exists(results_file) or os.path.getsize(results_file) == 0:
         csvwriter.writerow(header)
 
 
-def calculate_and_log_metrics(deployment_name, log_file_path, log_dir):
-    metrics = {}
-    for calculate in deployments_mapping[deployment_name]:
-        result_type = calculate.__name__
-        
-        if result_type == "calculate_ids_motion" and deployment_name == "ids":
-            info_log_files = glob(os.path.join(log_dir, f"info-{deployment_name}-*.log"))
-            if info_log_files:
-                info_log_file_path = info_log_files[0]
-                result = calculate(info_log_file_path)
-            else:
-                result = ""
-        else:
-            result = calculate(log_file_path)
+def archive_stale_results(results_file, header):
+    if not os.path.exists(results_file) or os.path.getsize(results_file) == 0:
+        return
+    with open(results_file, 'r', newline='') as csvfile:
+        existing_header = next(csv.reader(csvfile), [])
+    if existing_header != header:
+        root, extension = os.path.splitext(results_file)
+        archived_file = f"{root}.{time.strftime('%Y%m%d%H%M%S')}{extension}"
+        os.rename(results_file, archived_file)
+        logger.warning(f"{results_file} has a different header, moved it to {archived_file}")
+
+
+def build_combo_header(deployments):
+    header = ["VRAM (MB)", "RAM (GB)", "CPU (%)", "GPU (%)"]
+    for deployment_name in deployments:
+        header.append(f"{deployment_name} - Camera Number")
+        header += [f"{deployment_name} - {metric_column_titles[metric_class.name]}"
+                   for metric_class in deployments_mapping.get(deployment_name, [])]
+    return header
+
+
+def pod_deployment_name(pod_name):
+    return pod_name.split('-')[0]
+
+
+def create_pod_metrics(deployment_name, source="", continuation=False):
+    metrics = [CameraNumber(deployment_name, source, continuation)]
+    metrics += [metric_class(source, continuation) for metric_class in deployments_mapping.get(deployment_name, [])
+                if metric_class.log_source == "pod"]
+    return metrics
+
+
+def create_info_metrics(deployment_name, source=""):
+    return [metric_class(source) for metric_class in deployments_mapping.get(deployment_name, [])
+            if metric_class.log_source == "info"]
+
+
+class LiveMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pods = {}
+
+    def _entry(self, pod_name):
+        with self.lock:
+            return self.pods.setdefault(pod_name, {"pod": [], "info": []})
+
+    def create_pod_metrics(self, pod_name):
+        metrics = create_pod_metrics(pod_deployment_name(pod_name), pod_name)
+        self._entry(pod_name)["pod"] = metrics
+        return metrics
+
+    def create_info_metrics(self, pod_name):
+        metrics = create_info_metrics(pod_deployment_name(pod_name), f"info-{pod_name}")
+        self._entry(pod_name)["info"] = metrics
+        return metrics
 
-        metrics[result_type] = result if result is not None else ""
+    def pod_metrics(self, deployments):
+        with self.lock:
+            pods = dict(self.pods)
+        return {pod_name: entry["pod"] + entry["info"]
+                for pod_name, entry in sorted(pods.items())
+                if entry["pod"] and pod_name.startswith(tuple(deployments))}
+
+
+def summarize_metrics(label, metrics):
+    summary = {"Statistics": {}}
+    for metric in metrics:
+        result = "error" if metric.failed else metric.result()
+
+        if isinstance(metric, CameraNumber):
+            summary["Camera Number"] = result
+            continue
+
+        summary[metric.name] = result if result is not None else ""
+
+        stats = None if metric.failed else metric.stats()
+        if stats is not None:
+            summary["Statistics"][metric.name] = stats
 
         if result is not None:
             if isinstance(result, dict):
                 formatted_result = json.dumps(result, indent=2)
-                logger.info(f"Result for {deployment_name}: \n\n{formatted_result}\n\n")
+                logger.info(f"Result for {label}: \n\n{formatted_result}\n\n")
             else:
-                logger.info(f"Result for {deployment_name}: {result}\n")
+                logger.info(f"Result for {label}: {result}\n")
+
+    return summary
+
 
+def parse_pod_metrics(pod_name, log_file_path, log_dir=None):
+    pod_metrics = create_pod_metrics(pod_deployment_name(pod_name), log_file_path)
+    logger.debug(f"Parsing {log_file_path} for {[m.name for m in pod_metrics]}")
+    parse_log_file(log_file_path, pod_metrics)
+
+    info_metrics = parse_pod_info_log(pod_name, log_dir) if log_dir else []
+    return pod_metrics + info_metrics
+
+
+def calculate_and_log_metrics(deployment_name, log_file_path, log_dir):
+    pod_name = strip_log_extension(os.path.basename(log_file_path))
+    return summarize_metrics(deployment_name, parse_pod_metrics(pod_name, log_file_path, log_dir))
+
+
+def parse_pod_log_chunk(pod_name, log_file_path, start, end):
+    metrics = create_pod_metrics(pod_deployment_name(pod_name), log_file_path, continuation=start > 0)
+    parse_log_chunk(log_file_path, start, end, metrics)
     return metrics
 
 
-def process_single_deployments(csvwriter, log_dir, deployments, hardware_metrics):
-    log_files = glob(os.path.join(log_dir, "*.log"))
-    for log_file_path in log_files:
+def parse_pod_info_log(pod_name, log_dir):
+    info_log_files = glob(os.path.join(log_dir, f"info-{pod_name}.log*"))
+    if not info_log_files:
+        return []
+    info_metrics = create_info_metrics(pod_deployment_name(pod_name), info_log_files[0])
+    if info_metrics:
+        parse_log_file(info_log_files[0], info_metrics)
+    return info_metrics
+
+
+def find_pod_log_files(log_dir, deployments):
+    pod_log_files = {}
+    for log_file_path in sorted(glob(os.path.join(log_dir, "*.log*"))):
         file_name = os.path.basename(log_file_path)
         if file_name.startswith(tuple(deployments)):
+            pod_log_files[strip_log_extension(file_name)] = log_file_path
+    return pod_log_files
+
+
+def available_cpus():
+    # os.cpu_count() is the node's core count; a pod is limited by its CPU affinity and its cgroup CPU quota.
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open(CGROUP_CPU_MAX, 'r') as file:
+            quota, period = file.read().split()[:2]
+        if quota != "max":
+            cpus = min(cpus, max(int(int(quota) / int(period)), 1))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def calculate_pod_metrics(log_dir, deployments, workers=1, chunk_bytes=PROCESSING_CHUNK_BYTES):
+    pod_log_files = find_pod_log_files(log_dir, deployments)
+    if workers <= 1:
+        pod_metrics = {}
+        for pod_name, log_file_path in pod_log_files.items():
             logger.debug(f"Processing pod log file: {log_file_path}")
-            deployment_name = file_name.split('-')[0]
+            pod_metrics[pod_name] = parse_pod_metrics(pod_name, log_file_path, log_dir)
+        return pod_metrics
+
+    # Compressed logs cannot be entered at an arbitrary offset and are parsed whole.
+    pod_chunks = {pod_name: find_chunk_boundaries(log_file_path, chunk_bytes) if log_file_path.endswith(".log") else None
+                  for pod_name, log_file_path in pod_log_files.items()}
+    tasks = sum(len(chunks) if chunks is not None else 1 for chunks in pod_chunks.values()) + len(pod_log_files)
+    workers = max(min(workers, tasks), 1)
+    logger.debug(f"Processing {len(pod_log_files)} pod log files with {workers} worker processes")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunk_futures = {}
+        info_futures = {}
+        for pod_name, log_file_path in pod_log_files.items():
+            if pod_chunks[pod_name] is not None:
+                chunk_futures[pod_name] = [executor.submit(parse_pod_log_chunk, pod_name, log_file_path, start, end)
+                                           for start, end in pod_chunks[pod_name]]
+            else:
+                chunk_futures[pod_name] = [executor.submit(parse_pod_metrics, pod_name, log_file_path, None)]
+            info_futures[pod_name] = executor.submit(parse_pod_info_log, pod_name, log_dir)
 
-            with open(log_file_path, 'r') as log_file:
-                logs = log_file.read()
+        pod_metrics = {}
+        for pod_name, futures in chunk_futures.items():
+            pod_metrics[pod_name] = concat_metrics(future.result() for future in futures) + info_futures[pod_name].result()
+    return pod_metrics
 
-            camera_number = extract_camera_number(logs, deployment_name)
-            logger.info(f"{deployment_name} camera number: {camera_number}")
-            camera_info = camera_number if camera_number else ""
 
-            row = [deployment_name, camera_info] + [hardware_metrics.get(k, "") for k in ["VRAM", "RAM", "CPU", "GPU"]] + [""] * 5
+def aggregate_deployment_metrics(pod_metrics):
+    deployment_pods = {}
+    for pod_name, metrics in pod_metrics.items():
+        deployment_pods.setdefault(pod_deployment_name(pod_name), []).append(metrics)
+    return {deployment_name: merge_metrics(metric_lists) for deployment_name, metric_lists in deployment_pods.items()}
 
-            if deployment_name in deployments_mapping:
-                metrics = calculate_and_log_metrics(deployment_name, log_file_path, log_dir)
-                row[6:] = [metrics.get("calculate_average_load", ""), 
-                           metrics.get("calculate_num_samples", ""), 
-                           metrics.get("calculate_queue_size", ""), 
-                           metrics.get("calculate_fps", ""), 
-                           metrics.get("calculate_ids_motion", "")]
 
-            csvwriter.writerow(row)
+def process_single_deployments(csvwriter, pod_results, hardware_metrics, pod_hardware_metrics=None):
+    for pod_name, metrics in pod_results.items():
+        deployment_name = pod_deployment_name(pod_name)
+        pod_hardware = (pod_hardware_metrics or {}).get(pod_name, hardware_metrics)
+
+        camera_number = metrics.get("Camera Number")
+        logger.info(f"{deployment_name} camera number: {camera_number}")
+        camera_info = camera_number if camera_number else ""
+
+        row = [deployment_name, camera_info] + [pod_hardware.get(k, "") for k in ["VRAM", "RAM", "CPU", "GPU"]] + [""] * 5
+
+        if deployment_name in deployments_mapping:
+            row[6:] = [metrics.get("calculate_average_load", ""), 
+                       metrics.get("calculate_num_samples", ""), 
+                       metrics.get("calculate_queue_size", ""), 
+                       metrics.get("calculate_fps", ""), 
+                       metrics.get("calculate_ids_motion", "")]
+
+        csvwriter.writerow(row)
 
 
-def process_combo_deployments(csvwriter, log_dir, deployments, hardware_metrics, combo_header):
+def process_combo_deployments(csvwriter, deployment_results, pod_results, deployments, hardware_metrics, combo_header):
     row = [hardware_metrics.get("VRAM", ""),
            hardware_metrics.get("RAM", ""),
            hardware_metrics.get("CPU", ""),
            hardware_metrics.get("GPU", "")] + [""] * (len(combo_header) - 4)
 
-    family_column_indices = {
-        "ids": {"Camera Number": 4, "Server Load (%)": 5, "Motion Count": 6},
-        "ptd": {"Camera Number": 7, "Server Load (%)": 8},
-        "tfa": {"Camera Number": 9, "Num Samples": 10},
-        "ads": {"Camera Number": 11, "Queue Size": 12},
-        "frs": {"Camera Number": 13, "FPS": 14},
-        "aod": {"Camera Number": 15, "Server Load (%)": 16},
-        "fds": {"Camera Number": 11, "Queue Size": 12},
-    }
-
-    metric_name_to_column_title = {
-        'calculate_average_load': 'Server Load (%)',
-        'calculate_ids_motion': 'Motion Count',
-        'calculate_queue_size': 'Queue Size',
-        'calculate_fps': 'FPS',
-        'calculate_num_samples': 'Num Samples'
-    }
-
     for deployment_name in deployments:
-        log_file_pattern = f"{deployment_name}-*.log"
-        log_files = glob(os.path.join(log_dir, log_file_pattern))
-        log_file_path = log_files[0] if log_files else None
+        if deployment_name in deployment_results:
+            metrics = deployment_results[deployment_name]
+            camera_number = metrics.get("Camera Number")
+            logger.info(f"{deployment_name} camera number: {camera_number}")
 
-        if log_file_path:
-            with open(log_file_path, 'r') as log_file:
-                logs = log_file.read()
+            pod_names = [p for p in pod_results if pod_deployment_name(p) == deployment_name]
+            for pod_name in pod_names:
+                pod_metrics = {k: v for k, v in pod_results[pod_name].items() if k != "Statistics"}
+                logger.info(f"{deployment_name} replica {pod_name}: {pod_metrics}")
+
+            columns = {"Camera Number": camera_number}
+            columns.update({column_title: metrics.get(metric_name, "") for metric_name, column_title in metric_column_titles.items()})
+            for column_title, metric_value in columns.items():
+                column = f"{deployment_name} - {column_title}"
+                if column in combo_header:
+                    index = combo_header.index(column)
+                    row[index] = metric_value
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"Assigned {column} ({metric_value}) to column {index}")
 
-            metrics = calculate_and_log_metrics(deployment_name, log_file_path, log_dir)
-            camera_number = extract_camera_number(logs, deployment_name)
-            logger.info(f"{deployment_name} camera number: {camera_number}")
-            metrics["Camera Number"] = camera_number
+    csvwriter.writerow(row)
 
-            column_mapping = family_column_indices.get(deployment_name, {})
-            for metric_function_name, column_title in metric_name_to_column_title.items():
-                metric_value = metrics.get(metric_function_name, "")
-                if column_title in column_mapping:
-                    column_index = column_mapping[column_title]
-                    row[column_index] = metric_value
-                    logger.debug(f"Assigned {column_title} ({metric_value}) to column {column_index}")
 
-            if "Camera Number" in column_mapping:
-                camera_number_column_index = column_mapping["Camera Number"]
-                row[camera_number_column_index] = camera_number
+def write_metric_statistics(results_file, pod_results, deployment_results):
+    timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+    results = [(pod_deployment_name(pod_name), pod_name, metrics) for pod_name, metrics in pod_results.items()]
+    results += [(deployment_name, ALL_REPLICAS, metrics) for deployment_name, metrics in deployment_results.items()]
+
+    with open(results_file, 'a', newline='') as csvfile:
+        csvwriter = csv.writer(csvfile)
+        write_csv_header(csvwriter, results_file, statistics_header)
+        for deployment_name, pod_name, metrics in results:
+            for metric_name, stats in metrics["Statistics"].items():
+                row = [timestamp, deployment_name, pod_name, metric_name]
+                row += ["" if stats[column] is None else stats[column] for column in statistics_columns]
+                csvwriter.writerow(row)
+
+
+def deployment_nodes(pod_nodes, deployments):
+    nodes = {}
+    for pod_name, node in pod_nodes.items():
+        deployment_name = pod_deployment_name(pod_name)
+        if deployment_name in deployments:
+            nodes.setdefault(deployment_name, set()).add(node)
+    return nodes
+
+
+def write_hardware_results(results_file, node_averages, nodes_by_deployment):
+    timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+    results = [("node", node, node, averages) for node, averages in node_averages.items()]
+    for deployment_name, nodes in sorted(nodes_by_deployment.items()):
+        averages = combine_hardware_averages(node_averages[n] for n in nodes if n in node_averages)
+        results.append(("deployment", deployment_name, ";".join(sorted(nodes)), averages))
+
+    with open(results_file, 'a', newline='') as csvfile:
+        csvwriter = csv.writer(csvfile)
+        write_csv_header(csvwriter, results_file, hardware_header)
+        for scope, name, nodes, averages in results:
+            row = [timestamp, scope, name, nodes]
+            row += ["" if averages.get(key) is None else averages[key] for key in ["vram", "ram", "cpu", "gpu"]]
+            csvwriter.writerow(row)
 
-    csvwriter.writerow(row)
 
+def collect_hardware_metrics(log_dir, pod_nodes, running_deployments, hardware_results_file=None):
+    node_averages = parse_node_hardware_averages(log_dir, set(pod_nodes.values()))
+    nodes_by_deployment = deployment_nodes(pod_nodes, running_deployments)
+    for node, averages in node_averages.items():
+        logger.info(f"Hardware metrics for node {node}: {format_hardware_metrics(averages)}")
+
+    pod_hardware_metrics = {pod_name: format_hardware_metrics(node_averages[node])
+                            for pod_name, node in pod_nodes.items() if node in node_averages}
+    used_nodes = set().union(*nodes_by_deployment.values()) if nodes_by_deployment else set()
+    hardware_metrics = format_hardware_metrics(combine_hardware_averages(node_averages[n] for n in sorted(used_nodes)
+                                                                        if n in node_averages))
+
+    if hardware_results_file and node_averages:
+        write_hardware_results(hardware_results_file, node_averages, nodes_by_deployment)
+
+    return hardware_metrics, pod_hardware_metrics, node_averages
+
+
+def write_window_results(results_file, deployment_windows, nodes_by_deployment, window_seconds=WINDOW_SECONDS):
+    timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+    with open(results_file, 'a', newline='') as csvfile:
+        csvwriter = csv.writer(csvfile)
+        write_csv_header(csvwriter, results_file, window_header)
+        for deployment_name, windows in sorted(deployment_windows.items()):
+            nodes = ";".join(sorted(n for n in nodes_by_deployment.get(deployment_name, ()) if n))
+            for window in sorted(windows):
+                entry = windows[window]
+                row = [timestamp, deployment_name, window, window + window_seconds, nodes]
+                row += [entry.get(column, "") for column in ["load", "fps", "queue_size", "samples"]]
+                row += ["" if entry.get(column) is None else entry[column] for column in HARDWARE_COLUMNS]
+                row.append(entry["saturated"])
+                csvwriter.writerow(row)
+
+
+def run_window_analysis(log_dir, deployment_metrics, pod_nodes, running_deployments, window_results_file):
+    if pod_nodes:
+        nodes_by_deployment = deployment_nodes(pod_nodes, running_deployments)
+        nodes = set(pod_nodes.values())
+    else:
+        nodes_by_deployment = {d: {None} for d in running_deployments}
+        nodes = {None}
+
+    node_samples = {}
+    for node in nodes:
+        hardware_samples = load_hardware_samples(log_dir, node)
+        if hardware_samples is not None:
+            node_samples[node] = hardware_samples["samples"]
+
+    deployment_windows = analyze_windows(deployment_metrics, node_samples, nodes_by_deployment)
+    if deployment_windows:
+        write_window_results(window_results_file, deployment_windows, nodes_by_deployment)
 
-def process_and_write_results(log_dir, deployments, single_results_file, combo_results_file):
+
+@profiled
+def process_and_write_results(log_dir, deployments, single_results_file, combo_results_file, live_metrics=None,
+                              statistics_results_file=None, processing_workers=1, pod_nodes=None,
+                              hardware_results_file=None, window_results_file=None, results_db=None, run_info=None,
+                              pod_images=None):
     single_header = ["Deployment Name", "Camera Number", "VRAM (MB)", "RAM (GB)", "CPU (%)", "GPU (%)", 
                 "Server Load (%)", "Num Samples", "Queue Size", "FPS", "Motion Count"]
 
-    combo_header = ["VRAM (MB)", "RAM (GB)", "CPU (%)", "GPU (%)", 
-                    "ids - Camera Number", "ids - Server Load (%)", "ids - Motion Count", 
-                    "ptd - Camera Number", "ptd - Server Load (%)",
-                    "tfa - Camera Number", "tfa - Num Samples", 
-                    "ads - Camera Number", "ads - Queue Size",
-                    "frs - Camera Number", "frs - FPS",
-                    "aod - Camera Number", "aod - Server Load (%)"]
+    combo_header = build_combo_header(deployments)
 
-    hardware_metrics = parse_hardware_metrics(log_dir)
+    with timed("parse"):
+        if live_metrics is not None:
+            logger.debug("Using metrics computed during capture.")
+            pod_metrics = live_metrics.pod_metrics(deployments)
+        else:
+            pod_metrics = calculate_pod_metrics(log_dir, deployments, processing_workers)
 
-    log_files = glob(os.path.join(log_dir, "*.log"))
+        pod_results = {pod_name: summarize_metrics(pod_name, metrics) for pod_name, metrics in pod_metrics.items()}
+        deployment_metrics = aggregate_deployment_metrics(pod_metrics)
+        deployment_results = {deployment_name: summarize_metrics(deployment_name, metrics)
+                              for deployment_name, metrics in deployment_metrics.items()}
 
-    running_deployments = [d for d in deployments if any(log_file.startswith(os.path.join(log_dir, d)) for log_file in log_files)]
+    running_deployments = [d for d in deployments if d in deployment_results]
     num_running_deployments = len(running_deployments)
 
     logger.debug(f"Found {num_running_deployments} running deployments: {running_deployments}")
 
-    if num_running_deployments > 1:
-        with open(combo_results_file, 'a', newline='') as csvfile:
-            csvwriter = csv.writer(csvfile)
-            write_csv_header(csvwriter, combo_results_file, combo_header)
-            process_combo_deployments(csvwriter, log_dir, running_deployments, hardware_metrics, combo_header)
-    elif num_running_deployments == 1:
-        with open(single_results_file, 'a', newline='') as csvfile:
-            csvwriter = csv.writer(csvfile)
-            write_csv_header(csvwriter, single_results_file, single_header)
-            process_single_deployments(csvwriter, log_dir, running_deployments, hardware_metrics)
-    else:
-        logger.debug("No deployments are currently running.")
+    with timed("hardware"):
+        if pod_nodes:
+            hardware_metrics, pod_hardware_metrics, node_averages = collect_hardware_metrics(log_dir, pod_nodes, running_deployments,
+                                                                                             hardware_results_file)
+        else:
+            hardware_samples = load_hardware_samples(log_dir)
+            node_averages = {None: hardware_samples["averages"]} if hardware_samples is not None else {}
+            hardware_metrics = format_hardware_metrics(hardware_samples["averages"]) if hardware_samples is not None else {}
+            pod_hardware_metrics = {}
+
+    if results_db and run_info and pod_results:
+        try:
+            with timed("result_store"):
+                record_run(results_db, run_info, pod_results, deployment_results, pod_nodes, pod_images, node_averages)
+        except sqlite3.Error as e:
+            logger.error(f"Could not record run {run_info['run_id']} in {results_db}: {e}")
+
+    if window_results_file and deployment_metrics:
+        with timed("window_analysis"):
+            run_window_analysis(log_dir, deployment_metrics, pod_nodes, running_deployments, window_results_file)
+
+    with timed("csv_write"):
+        if statistics_results_file and pod_results:
+            write_metric_statistics(statistics_results_file, pod_results, deployment_results)
+
+        if num_running_deployments > 1:
+            archive_stale_results(combo_results_file, combo_header)
+            with open(combo_results_file, 'a', newline='') as csvfile:
+                csvwriter = csv.writer(csvfile)
+                write_csv_header(csvwriter, combo_results_file, combo_header)
+                process_combo_deployments(csvwriter, deployment_results, pod_results, running_deployments, hardware_metrics, combo_header)
+        elif num_running_deployments == 1:
+            with open(single_results_file, 'a', newline='') as csvfile:
+                csvwriter = csv.writer(csvfile)
+                write_csv_header(csvwriter, single_results_file, single_header)
+                process_single_deployments(csvwriter, pod_results, hardware_metrics, pod_hardware_metrics)
+        else:
+            logger.debug("No deployments are currently running.")
 
     logger.debug("Finished processing and writing results.")
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+import base64
+import hashlib
+import json
+import math
+import re
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from synthetic_logs import pod_log_line, motion_alert_line, format_log_timestamp
+
+LOG_TICK = 0.01
+MAX_BATCH_LINES = 10000
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+EXEC_CHUNK_BYTES = 64 * 1024
+
+DEPLOYMENTS_PATH = re.compile(r'^/apis/apps/v1/namespaces/([^/]+)/deployments$')
+PODS_PATH = re.compile(r'^/api/v1/namespaces/([^/]+)/pods$')
+POD_LOG_PATH = re.compile(r'^/api/v1/namespaces/([^/]+)/pods/([^/]+)/log$')
+POD_EXEC_PATH = re.compile(r'^/api/v1/namespaces/([^/]+)/pods/([^/]+)/exec$')
+
+
+def expected_lines(started_at, lines_per_second, start, end):
+    first = max(math.ceil((start - started_at) * lines_per_second), 0)
+    last = math.floor((end - started_at) * lines_per_second)
+    return max(last - first + 1, 0)
+
+
+class FakeKubernetesApi:
+    def __init__(self, namespaces, pods_per_namespace=1, lines_per_second=100, noise=0.5, info_lines_per_second=10,
+                 host="127.0.0.1", port=0, started_at=None):
+        self.namespaces = list(namespaces)
+        self.pods_per_namespace = pods_per_namespace
+        self.lines_per_second = lines_per_second
+        self.noise = noise
+        self.info_lines_per_second = info_lines_per_second
+        self.started_at = started_at or time.time()
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.lines_sent = {}
+        self.max_lag = 0.0
+        self.info_line_bytes = len(motion_alert_line(0, self.started_at))
+
+        api = self
+
+        class Handler(FakeKubernetesHandler):
+            fake_api = api
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def pod_names(self, namespace):
+        return [f"{namespace}-synthetic-{i}" for i in range(self.pods_per_namespace)]
+
+    def line_time(self, index):
+        return self.started_at + index / self.lines_per_second
+
+    def expected_lines(self, start, end):
+        return expected_lines(self.started_at, self.lines_per_second, start, end)
+
+    def record_sent(self, pod_name, count, lag):
+        with self.lock:
+            self.lines_sent[pod_name] = self.lines_sent.get(pod_name, 0) + count
+            self.max_lag = max(self.max_lag, lag)
+
+    def stats(self):
+        with self.lock:
+            return {"lines_sent": sum(self.lines_sent.values()), "max_lag_seconds": self.max_lag}
+
+    def info_log_size(self):
+        return (math.floor((time.time() - self.started_at) * self.info_lines_per_second) + 1) * self.info_line_bytes
+
+    def info_log_bytes(self, offset):
+        first = offset // self.info_line_bytes
+        last = self.info_log_size() // self.info_line_bytes
+        return "".join(motion_alert_line(i, self.started_at + i / self.info_lines_per_second) for i in range(first, last))
+
+    def exec_output(self, command):
+        if command[:2] == ["wc", "-c"]:
+            return f"{self.info_log_size()} {command[2]}\n"
+        if command[:2] == ["tail", "-c"] and command[2].startswith("+"):
+            return self.info_log_bytes(int(command[2][1:]) - 1)
+        return ""
+
+    def deployment(self, namespace):
+        labels = {"app": namespace}
+        replicas = self.pods_per_namespace
+        return {
+            "metadata": {"name": f"{namespace}-synthetic", "namespace": namespace, "generation": 1, "resourceVersion": "1"},
+            "spec": {
+                "replicas": replicas,
+                "selector": {"matchLabels": labels},
+                "template": {"metadata": {"labels": labels},
+                             "spec": {"containers": [{"name": namespace, "image": f"synthetic/{namespace}:latest"}]}},
+            },
+            "status": {"observedGeneration": 1, "replicas": replicas, "updatedReplicas": replicas,
+                       "readyReplicas": replicas, "availableReplicas": replicas},
+        }
+
+    def pod(self, namespace, pod_name):
+        return {
+            "metadata": {"name": pod_name, "namespace": namespace, "labels": {"app": namespace}, "resourceVersion": "1"},
+            "spec": {"nodeName": "synthetic-node", "containers": [{"name": namespace, "image": f"synthetic/{namespace}:latest"}]},
+            "status": {"phase": "Running", "conditions": [{"type": "Ready", "status": "True"}]},
+        }
+
+
+class FakeKubernetesHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fake_api = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, body, status=200):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        api = self.fake_api
+
+        match = DEPLOYMENTS_PATH.match(url.path)
+        if match:
+            namespace = match.group(1)
+            items = [api.deployment(namespace)] if namespace in api.namespaces else []
+            return self.send_json({"kind": "DeploymentList", "apiVersion": "apps/v1",
+                                   "metadata": {"resourceVersion": "1"}, "items": items})
+
+        match = PODS_PATH.match(url.path)
+        if match:
+            namespace = match.group(1)
+            items = [api.pod(namespace, p) for p in api.pod_names(namespace)] if namespace in api.namespaces else []
+            return self.send_json({"kind": "PodList", "apiVersion": "v1", "metadata": {"resourceVersion": "1"}, "items": items})
+
+        match = POD_LOG_PATH.match(url.path)
+        if match:
+            return self.stream_log(match.group(2), query)
+
+        match = POD_EXEC_PATH.match(url.path)
+        if match and self.headers.get("Upgrade", "").lower() == "websocket":
+            return self.exec_websocket(query.get("command", []))
+
+        self.send_json({"kind": "Status", "status": "Failure", "reason": "NotFound", "code": 404}, 404)
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def stream_log(self, pod_name, query):
+        api = self.fake_api
+        follow = query.get("follow", ["false"])[0] == "true"
+        timestamps = query.get("timestamps", ["false"])[0] == "true"
+        since_seconds = int(query.get("sinceSeconds", [0])[0])
+        remaining_bytes = int(query["limitBytes"][0]) if "limitBytes" in query else None
+        deployment_name = pod_name.split('-')[0]
+
+        now = time.time()
+        since = now - since_seconds if since_seconds else api.started_at
+        index = max(math.ceil((since - api.started_at) * api.lines_per_second), 0)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        try:
+            while not api.stopping.is_set():
+                last = min(math.floor((time.time() - api.started_at) * api.lines_per_second), index + MAX_BATCH_LINES - 1)
+                if index <= last:
+                    lines = []
+                    for i in range(index, last + 1):
+                        line = pod_log_line(deployment_name, i, api.noise)
+                        lines.append(f"{format_log_timestamp(api.line_time(i))} {line}\n" if timestamps else f"{line}\n")
+                    data = "".join(lines).encode('utf-8')
+                    if remaining_bytes is not None:
+                        data = data[:remaining_bytes]
+                        remaining_bytes -= len(data)
+                    self.write_chunk(data)
+                    # How far behind real time the generator is; a large lag means the fake API is the bottleneck.
+                    api.record_sent(pod_name, last + 1 - index, time.time() - api.line_time(last))
+                    index = last + 1
+                    if remaining_bytes == 0:
+                        break
+                elif not follow:
+                    break
+                else:
+                    time.sleep(LOG_TICK)
+            self.write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+    def send_frame(self, opcode, payload):
+        header = bytes([0x80 | opcode])
+        if len(payload) < 126:
+            header += bytes([len(payload)])
+        elif len(payload) < 65536:
+            header += bytes([126]) + struct.pack("!H", len(payload))
+        else:
+            header += bytes([127]) + struct.pack("!Q", len(payload))
+        self.wfile.write(header + payload)
+
+    def exec_websocket(self, command):
+        key = self.headers.get("Sec-WebSocket-Key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode('ascii')).digest()).decode('ascii')
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.send_header("Sec-WebSocket-Protocol", "v4.channel.k8s.io")
+        self.end_headers()
+
+        output = self.fake_api.exec_output(command).encode('utf-8')
+        try:
+            for start in range(0, len(output), EXEC_CHUNK_BYTES):
+                self.send_frame(0x2, b"\x01" + output[start:start + EXEC_CHUNK_BYTES])
+            self.send_frame(0x2, b"\x03" + json.dumps({"metadata": {}, "status": "Success"}).encode('utf-8'))
+            self.send_frame(0x8, struct.pack("!H", 1000))
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
@@ -2,55 +2,231 @@
 
 import subprocess
 import os
+import json
+import math
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 
 from logg import logger
+from hw_sampler import average, summarize_samples
+from telemetry import increment
 
+HW_SAMPLES_FILE = "hw_samples.jsonl"
+HW_SAMPLER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hw_sampler.py")
+SSH_CONNECT_TIMEOUT = 30
+HW_STREAM_GRACE = 30
+HW_RECONNECT_MIN_SECONDS = 1
+HW_RECONNECT_MAX_SECONDS = 60
 
-def run_command(command):
-    logger.debug(f"Running command: {' '.join(command)}")
-    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    if result.stdout:
-        logger.info(f"stdout: {result.stdout}")
-    if result.stderr:
-        logger.error(f"stderr: {result.stderr}")
-    return result
 
+class SshSession:
+    def __init__(self, remote_user, remote_ip, ssh_password):
+        self.target = f"{remote_user}@{remote_ip}"
+        self.ssh_password = ssh_password
+        self.control_path = os.path.join(tempfile.gettempdir(), f"bench-ssh-{remote_user}@{remote_ip}")
+        self.master = None
 
-def run_hw_metrics(log_dir, duration, remote_user, remote_ip, ssh_password):
-    script_src_path = "hw.sh"
-    remote_script_path = f"/tmp/{os.path.basename(script_src_path)}"
-    remote_output_path = "/tmp/hw_output.txt"
-    local_output_path = os.path.join(log_dir, "hw_output.txt")
+    def ssh_command(self, *args):
+        return ["ssh", "-o", "StrictHostKeyChecking=no", "-o", f"ControlPath={self.control_path}", *args]
 
-    cleanup_command = f"rm -f {remote_script_path} {remote_output_path}"
-    
-    run_command(["sshpass", "-p", ssh_password, "ssh", "-o", "StrictHostKeyChecking=no", f"{remote_user}@{remote_ip}", cleanup_command])
-    run_command(["sshpass", "-p", ssh_password, "scp", script_src_path, f"{remote_user}@{remote_ip}:{remote_script_path}"])
-    run_command(["sshpass", "-p", ssh_password, "ssh", "-o", "StrictHostKeyChecking=no", f"{remote_user}@{remote_ip}", f"bash {remote_script_path} {duration}"])
-    run_command(["sshpass", "-p", ssh_password, "scp", f"{remote_user}@{remote_ip}:{remote_output_path}", local_output_path])
+    def is_open(self):
+        result = subprocess.run(self.ssh_command("-O", "check", self.target), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return result.returncode == 0
 
-    with open(local_output_path, 'r') as output_file:
-        hardware_metrics = output_file.read()
-    logger.info("---- Hardware Metrics Results ----\n")
-    logger.info(f"\n\n{hardware_metrics}")
+    def open(self):
+        logger.debug(f"Opening SSH control connection to {self.target}")
+        self.master = subprocess.Popen(["sshpass", "-p", self.ssh_password] +
+                                       self.ssh_command("-o", "ControlMaster=yes", "-o", "ServerAliveInterval=15", "-N", self.target),
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        deadline = time.monotonic() + SSH_CONNECT_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.is_open():
+                return self
+            if self.master.poll() is not None:
+                raise RuntimeError(f"SSH connection to {self.target} failed: {self.master.stderr.read().strip()}")
+            time.sleep(0.2)
+        self.close()
+        raise RuntimeError(f"Timed out opening SSH connection to {self.target}")
 
+    def stream(self, command, stdin_data=None):
+        logger.debug(f"Running on {self.target}: {command}")
+        process = subprocess.Popen(self.ssh_command("-o", "ControlMaster=no", self.target, command),
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if stdin_data is not None:
+            process.stdin.write(stdin_data)
+        process.stdin.close()
+        return process
 
-def parse_hardware_metrics(log_dir):
-    hardware_metrics_file = os.path.join(log_dir, "hw_output.txt")
-    hardware_metrics = {}
+    def clock_offset(self):
+        started_at = time.time()
+        result = subprocess.run(self.ssh_command("-o", "ControlMaster=no", self.target, "python3 -c 'import time; print(time.time())'"),
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        ended_at = time.time()
+        if result.returncode != 0:
+            raise RuntimeError(f"Could not read the clock of {self.target}: {result.stderr.strip()}")
+        return float(result.stdout) - (started_at + ended_at) / 2
 
+    def close(self):
+        if self.master is None:
+            return
+        subprocess.run(self.ssh_command("-O", "exit", self.target), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if self.master.poll() is None:
+            self.master.terminate()
+        self.master.wait()
+        self.master = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def format_hardware_metrics(averages):
+    units = {"VRAM": ("vram", " MB"), "RAM": ("ram", " GB"), "CPU": ("cpu", "%"), "GPU": ("gpu", "%")}
+    return {name: f"{round(averages[key], 2)}{unit}" for name, (key, unit) in units.items()
+            if averages.get(key) is not None}
+
+
+def hw_samples_file(node=None):
+    return HW_SAMPLES_FILE if node is None else f"hw_samples-{node}.jsonl"
+
+
+def stream_hw_samples(session, duration, samples_path, clock_offset=0.0, on_sample=None):
+    with open(HW_SAMPLER_SCRIPT, 'r') as script_file:
+        script = script_file.read()
+
+    # The sampler is piped to the remote interpreter, so nothing has to be uploaded or cleaned up.
+    process = session.stream(f"python3 - {duration} --stream", script)
+    watchdog = threading.Timer(duration + HW_STREAM_GRACE, process.kill) if math.isfinite(duration) else None
+    if watchdog is not None:
+        watchdog.start()
+    sample_count = 0
+    try:
+        with (open(samples_path, 'w') if samples_path else nullcontext()) as samples_file:
+            for line in process.stdout:
+                try:
+                    sample = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Ignoring unexpected hardware sampler output: {line.strip()}")
+                    continue
+                # Timestamps are moved onto the local clock so samples from different nodes line up.
+                sample["node_timestamp"] = sample["timestamp"]
+                sample["timestamp"] -= clock_offset
+                if sample_count == 0 and sample.get("gpu_backend") == "none":
+                    logger.warning(f"No GPU backend on {session.target}, its GPU and VRAM usage is not collected")
+                if samples_file is not None:
+                    samples_file.write(json.dumps(sample) + '\n')
+                    samples_file.flush()
+                if on_sample is not None:
+                    on_sample(sample)
+                sample_count += 1
+        process.wait()
+    finally:
+        if watchdog is not None:
+            watchdog.cancel()
+
+    stderr = process.stderr.read()
+    if process.returncode != 0:
+        logger.error(f"Hardware sampler on {session.target} exited with {process.returncode}: {stderr.strip()}")
+    elif stderr:
+        logger.warning(f"Hardware sampler on {session.target}: {stderr.strip()}")
+    return sample_count
+
+
+def run_hw_metrics(log_dir, duration, remote_user, remote_ip, ssh_password, node=None, on_sample=None):
+    # A log_dir of None keeps the samples in memory only, for runs that never end.
+    samples_path = os.path.join(log_dir, hw_samples_file(node)) if log_dir else None
+    if samples_path is not None:
+        # Emptied before connecting, so a failed connection leaves no data instead of an earlier run's samples.
+        open(samples_path, 'w').close()
+    try:
+        with SshSession(remote_user, remote_ip, ssh_password) as session:
+            clock_offset = session.clock_offset()
+            logger.debug(f"Clock of {remote_ip} is {round(clock_offset, 3)}s off the local clock")
+            sample_count = stream_hw_samples(session, duration, samples_path, clock_offset,
+                                             None if on_sample is None else lambda sample: on_sample(node, sample))
+            logger.debug(f"Received {sample_count} hardware samples from {remote_ip}")
+    except (OSError, RuntimeError, ValueError) as e:
+        logger.error(f"Hardware metrics collection on {remote_ip} failed: {e}")
+
+    if samples_path is None:
+        return
+
+    hardware_metrics = parse_hardware_metrics(log_dir, node)
+    logger.info(f"---- Hardware Metrics Results{f' ({node})' if node else ''} ----\n")
+    logger.info(f"\n\n{json.dumps(hardware_metrics, indent=2)}")
+
+
+def run_hw_metrics_on_nodes(log_dir, duration, node_addresses, remote_user, ssh_password, on_sample=None):
+    with ThreadPoolExecutor(max_workers=len(node_addresses)) as executor:
+        for node, remote_ip in node_addresses.items():
+            executor.submit(run_hw_metrics, log_dir, duration, remote_user, remote_ip, ssh_password, node, on_sample)
+
+
+def follow_hw_metrics(remote_user, remote_ip, ssh_password, node=None, on_sample=None):
+    # For runs that never end, a sampler stream that drops is restarted, backing off while it keeps failing.
+    delay = HW_RECONNECT_MIN_SECONDS
+    while True:
+        started_at = time.monotonic()
+        run_hw_metrics(None, math.inf, remote_user, remote_ip, ssh_password, node, on_sample)
+        if time.monotonic() - started_at > HW_RECONNECT_MAX_SECONDS:
+            delay = HW_RECONNECT_MIN_SECONDS
+        increment("hw_stream_reconnects_total", node=node or remote_ip)
+        logger.warning(f"Hardware sampler stream from {remote_ip} ended, reconnecting in {delay}s")
+        time.sleep(delay)
+        delay = min(delay * 2, HW_RECONNECT_MAX_SECONDS)
+
+
+def load_hardware_samples(log_dir, node=None):
+    hardware_metrics_file = os.path.join(log_dir, hw_samples_file(node))
+    samples = []
     try:
         with open(hardware_metrics_file, 'r') as file:
             for line in file:
-                if "Average VRAM" in line:
-                    hardware_metrics["VRAM"] = line.split(":")[1].strip()
-                elif "Average RAM" in line:
-                    hardware_metrics["RAM"] = line.split(":")[1].strip()
-                elif "Average CPU" in line:
-                    hardware_metrics["CPU"] = line.split(":")[1].strip()
-                elif "Average GPU" in line:
-                    hardware_metrics["GPU"] = line.split(":")[1].strip()
+                try:
+                    samples.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping malformed hardware sample in {hardware_metrics_file}")
     except FileNotFoundError:
         logger.error(f"Hardware metrics file not found: {hardware_metrics_file}")
+        return None
+    if not samples:
+        logger.warning(f"No hardware samples in {hardware_metrics_file}")
+        return None
+    return {"samples": samples, "averages": summarize_samples(samples)}
+
+
+def parse_hardware_metrics(log_dir, node=None):
+    hardware_samples = load_hardware_samples(log_dir, node)
+    if hardware_samples is None:
+        return {}
+    return format_hardware_metrics(hardware_samples["averages"])
+
+
+def parse_node_hardware_averages(log_dir, nodes):
+    node_averages = {}
+    for node in sorted(nodes):
+        hardware_samples = load_hardware_samples(log_dir, node)
+        if hardware_samples is not None:
+            node_averages[node] = hardware_samples["averages"]
+    return node_averages
+
+
+def combine_hardware_averages(averages_list):
+    averages_list = list(averages_list)
+    return {key: average(a.get(key) for a in averages_list) for key in ("cpu", "ram", "gpu", "vram")}
+
 
-    return hardware_metrics
\ No newline at end of file
+def align_hardware_samples(node_samples, interval=1.0):
+    timeline = {}
+    for node, samples in node_samples.items():
+        buckets = {}
+        for sample in samples:
+            buckets.setdefault(math.floor(sample["timestamp"] / interval) * interval, []).append(sample)
+        for bucket, bucket_samples in buckets.items():
+            timeline.setdefault(bucket, {})[node] = summarize_samples(bucket_samples)
+    return dict(sorted(timeline.items()))
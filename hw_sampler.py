@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+# Runs on the benchmarked node itself, so it only depends on the standard library. NVIDIA GPUs are
+# sampled through pynvml when the node's python3 has it, otherwise through nvidia-smi.
+
+import argparse
+import collections
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+DEFAULT_INTERVAL = 1.0
+DEFAULT_CAPACITY = 86400
+NVIDIA_SMI_TIMEOUT = 5
+
+
+class GpuBackend:
+    name = None
+    errors = ()
+
+    def read(self):
+        raise NotImplementedError
+
+    def sample(self):
+        # A failed reading leaves a gap in the GPU columns instead of stopping the sampler.
+        try:
+            return self.read()
+        except self.errors:
+            return None, None
+
+    def close(self):
+        pass
+
+
+class NullGpuBackend(GpuBackend):
+    name = "none"
+
+    def read(self):
+        return None, None
+
+
+class FakeGpuBackend(GpuBackend):
+    # Cycles through fixed readings, so the GPU columns can be filled in on a node without a GPU.
+    name = "fake"
+
+    def __init__(self, samples=((0.0, 0.0),)):
+        self.samples = list(samples)
+        self.index = 0
+
+    def read(self):
+        sample = self.samples[self.index % len(self.samples)]
+        self.index += 1
+        return sample
+
+
+class NvmlGpuBackend(GpuBackend):
+    name = "nvml"
+
+    def __init__(self):
+        import pynvml
+        self.nvml = pynvml
+        self.errors = (pynvml.NVMLError,)
+        self.nvml.nvmlInit()
+        self.handles = [self.nvml.nvmlDeviceGetHandleByIndex(i) for i in range(self.nvml.nvmlDeviceGetCount())]
+
+    def read(self):
+        if not self.handles:
+            return None, None
+        utilization = [self.nvml.nvmlDeviceGetUtilizationRates(h).gpu for h in self.handles]
+        vram_mb = [self.nvml.nvmlDeviceGetMemoryInfo(h).used / (1024 * 1024) for h in self.handles]
+        return sum(utilization) / len(utilization), sum(vram_mb) / len(vram_mb)
+
+    def close(self):
+        self.nvml.nvmlShutdown()
+
+
+class NvidiaSmiGpuBackend(GpuBackend):
+    name = "nvidia-smi"
+    command = ["nvidia-smi", "--query-gpu=utilization.gpu,memory.used", "--format=csv,noheader,nounits"]
+    errors = (OSError, subprocess.SubprocessError, ValueError, IndexError)
+
+    def __init__(self):
+        if shutil.which(self.command[0]) is None:
+            raise RuntimeError("nvidia-smi is not installed")
+        self.read()
+
+    def read(self):
+        output = subprocess.run(self.command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                timeout=NVIDIA_SMI_TIMEOUT, check=True).stdout
+        readings = [[float(field) for field in line.split(",")] for line in output.splitlines() if line.strip()]
+        if not readings:
+            return None, None
+        return sum(r[0] for r in readings) / len(readings), sum(r[1] for r in readings) / len(readings)
+
+
+def get_gpu_backend(name="auto"):
+    if name == "fake":
+        return FakeGpuBackend()
+    if name == "none":
+        return NullGpuBackend()
+    if name == "nvml":
+        return NvmlGpuBackend()
+    if name == "nvidia-smi":
+        return NvidiaSmiGpuBackend()
+    errors = []
+    for backend in (NvmlGpuBackend, NvidiaSmiGpuBackend):
+        try:
+            return backend()
+        except Exception as e:
+            errors.append(f"{backend.name}: {e}")
+    print(f"No GPU backend available, GPU and VRAM are not sampled ({'; '.join(errors)})", file=sys.stderr, flush=True)
+    return NullGpuBackend()
+
+
+def read_cpu_times(proc_root="/proc"):
+    with open(os.path.join(proc_root, "stat")) as stat_file:
+        fields = stat_file.readline().split()[1:]
+    values = [int(v) for v in fields[:8]]
+    # Like `sar -u`, only idle counts as idle; iowait is busy time.
+    return sum(values), values[3]
+
+
+def read_memory_used_gb(proc_root="/proc"):
+    meminfo = {}
+    with open(os.path.join(proc_root, "meminfo")) as meminfo_file:
+        for line in meminfo_file:
+            key, value = line.split(":", 1)
+            meminfo[key] = int(value.split()[0])
+    available = meminfo.get("MemAvailable", meminfo.get("MemFree", 0))
+    return (meminfo["MemTotal"] - available) / (1024 * 1024)
+
+
+def average(values):
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else None
+
+
+def summarize_samples(samples):
+    return {key: average(s.get(key) for s in samples) for key in ("cpu", "ram", "gpu", "vram")}
+
+
+class HardwareSampler:
+    def __init__(self, interval=DEFAULT_INTERVAL, capacity=DEFAULT_CAPACITY, gpu_backend=None, proc_root="/proc",
+                 clock=time.monotonic, sleep=time.sleep, wall_clock=time.time):
+        self.interval = interval
+        self.gpu_backend = gpu_backend or NullGpuBackend()
+        self.proc_root = proc_root
+        self.clock = clock
+        self.sleep = sleep
+        self.wall_clock = wall_clock
+        self.samples = collections.deque(maxlen=capacity)
+        self.missed_ticks = 0
+        self.cpu_times = None
+
+    def sample_once(self):
+        total, idle = read_cpu_times(self.proc_root)
+        cpu = None
+        if self.cpu_times is not None and total > self.cpu_times[0]:
+            cpu = 100.0 * (1 - (idle - self.cpu_times[1]) / (total - self.cpu_times[0]))
+        self.cpu_times = (total, idle)
+
+        gpu, vram = self.gpu_backend.sample()
+        sample = {
+            "timestamp": self.wall_clock(),
+            "cpu": cpu,
+            "ram": read_memory_used_gb(self.proc_root),
+            "gpu": gpu,
+            "vram": vram,
+            "gpu_backend": self.gpu_backend.name,
+        }
+        self.samples.append(sample)
+        return sample
+
+    def run(self, duration, on_sample=None):
+        # Ticks are scheduled from a fixed start, so slow samples never push later ones back.
+        self.cpu_times = read_cpu_times(self.proc_root)
+        start = self.clock()
+        tick = 1
+        while tick * self.interval <= duration:
+            delay = start + tick * self.interval - self.clock()
+            if delay > 0:
+                self.sleep(delay)
+            elif -delay >= self.interval:
+                skipped = math.floor(-delay / self.interval)
+                self.missed_ticks += skipped
+                tick += skipped
+                continue
+            sample = self.sample_once()
+            if on_sample is not None:
+                on_sample(sample)
+            tick += 1
+
+    def summary(self):
+        return summarize_samples(self.samples)
+
+    def to_dict(self):
+        return {
+            "interval": self.interval,
+            "gpu_backend": self.gpu_backend.name,
+            "missed_ticks": self.missed_ticks,
+            "averages": self.summary(),
+            "samples": list(self.samples),
+        }
+
+    def write(self, output_path):
+        with open(output_path, "w") as output_file:
+            json.dump(self.to_dict(), output_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sample CPU, RAM, GPU and VRAM usage at a fixed cadence.")
+    parser.add_argument("duration", type=float)
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL)
+    parser.add_argument("--output", help="write all samples and averages as JSON to this file at the end")
+    parser.add_argument("--stream", action="store_true", help="print every sample as a JSON line as soon as it is taken")
+    parser.add_argument("--gpu-backend", default="auto", choices=["auto", "nvml", "nvidia-smi", "fake", "none"])
+    args = parser.parse_args()
+
+    def print_sample(sample):
+        print(json.dumps(sample), flush=True)
+
+    gpu_backend = get_gpu_backend(args.gpu_backend)
+    sampler = HardwareSampler(args.interval, gpu_backend=gpu_backend)
+    try:
+        sampler.run(args.duration, print_sample if args.stream else None)
+    finally:
+        gpu_backend.close()
+        if args.output:
+            sampler.write(args.output)
+
+
+if __name__ == "__main__":
+    main()
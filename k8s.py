@@ -1,93 +1,568 @@
 #!/usr/bin/env python3
 
 import os
-import time
+import math
 import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext, closing, ExitStack
 
-from kubernetes import client, config, watch, stream
+import urllib3
+from kubernetes import client, watch, stream
+from kubernetes.watch.watch import iter_resp_lines
+from calculations import feed_lines, split_log_timestamp, CAMERA_NUMBER_PATTERNS
+from log_sink import BufferedLogSink, log_file_name
+from node_logs import pod_log_directory, node_log_lines
 from logg import logger
+from telemetry import StreamStats, increment, timed, profiled
+from k8s_client import get_kubernetes_api_client, get_kubernetes_exec_api, reserve_log_streams, release_log_streams
 
+LOG_CONNECT_TIMEOUT = 10
+LOG_READ_TIMEOUT = 30
+LOG_HEADER_BYTES = 256 * 1024
+IDS_INFO_LOG = "/var/log/scylla/scylla-info.log"
+CAPTURE_BACKENDS = ("api", "node")
 
-def get_kubernetes_api_client():
-    config.load_incluster_config()
-    core_v1_api = client.CoreV1Api()
-    apps_v1_api = client.AppsV1Api()
-    return core_v1_api, apps_v1_api
 
+def validate_capture_backend(capture_backend):
+    if capture_backend not in CAPTURE_BACKENDS:
+        raise ValueError(f"Invalid capture backend: {capture_backend}")
 
-def capture_logs_from_pods_of_deployment(core_v1_api, deployment, namespace, duration, log_dir):
-    selector = ','.join([f'{k}={v}' for k, v in deployment.spec.selector.match_labels.items()])
-    pods = core_v1_api.list_namespaced_pod(namespace, label_selector=selector)
 
-    end_time = time.time() + duration
+def shutdown_stream(resp):
+    try:
+        resp.shutdown()
+    except (ValueError, RuntimeError, OSError):
+        pass
 
-    for pod in pods.items:
-        log_file_path = os.path.join(log_dir, f"{pod.metadata.name}.log")
-        try:
-            with open(log_file_path, 'w') as log_file:
-                w = watch.Watch()
-                for log_line in w.stream(core_v1_api.read_namespaced_pod_log, name=pod.metadata.name, namespace=namespace):
-                    if time.time() > end_time:
+
+def stream_pod_log(core_v1_api, pod_name, namespace, since, end_time):
+    # since_seconds has one second granularity, so after a reconnect the caller drops the lines it has already seen.
+    since_seconds = max(math.ceil(time.time() - since) + 1, 1)
+    read_timeout = max(min(LOG_READ_TIMEOUT, end_time - time.time()), 0.1)
+    with timed("stream_connect", namespace=namespace):
+        resp = core_v1_api.read_namespaced_pod_log(name=pod_name, namespace=namespace, follow=True, timestamps=True,
+                                                   since_seconds=since_seconds, _preload_content=False,
+                                                   _request_timeout=(LOG_CONNECT_TIMEOUT, read_timeout))
+    # A quiet stream sits in a blocking read that the read timeout restarts after every line, so shut the
+    # socket down at the deadline; urllib3 before 2.3 has no shutdown and falls back to the read timeout.
+    deadline = threading.Timer(max(end_time - time.time(), 0), shutdown_stream, [resp]) \
+        if hasattr(resp, "shutdown") and math.isfinite(end_time) else None
+    if deadline is not None:
+        deadline.daemon = True
+        deadline.start()
+    try:
+        for log_line in iter_resp_lines(resp):
+            yield log_line
+    finally:
+        if deadline is not None:
+            deadline.cancel()
+        resp.close()
+        resp.release_conn()
+
+
+def read_camera_line(core_v1_api, pod_name, namespace):
+    # The camera count is only logged at startup, long before the window, so look for it at the start of the log.
+    pattern = CAMERA_NUMBER_PATTERNS.get(pod_name.split('-')[0])
+    if pattern is None:
+        return None
+    header = core_v1_api.read_namespaced_pod_log(name=pod_name, namespace=namespace, timestamps=True,
+                                                 limit_bytes=LOG_HEADER_BYTES)
+    for log_line in header.splitlines():
+        if pattern.search(log_line):
+            return log_line
+    return None
+
+
+def api_log_lines(core_v1_api, pod_name, namespace, start_time, end_time, stop_event=None):
+    stop_event = stop_event or threading.Event()
+    last_timestamp = None
+    # The lines yielded with the latest timestamp; a reconnect replays them along with lines it has not seen yet.
+    last_lines = Counter()
+    reconnects = 0
+    try:
+        while time.time() < end_time and not stop_event.is_set():
+            since = start_time if last_timestamp is None else last_timestamp
+            replayed_until = last_timestamp
+            replayed = Counter(last_lines)
+            try:
+                for log_line in stream_pod_log(core_v1_api, pod_name, namespace, since, end_time):
+                    if stop_event.is_set():
                         break
-                    log_file.write(log_line + '\n')
-                    log_file.flush()
+                    timestamp, text = split_log_timestamp(log_line)
+                    if timestamp is not None:
+                        if replayed_until is not None and timestamp < replayed_until:
+                            continue
+                        if timestamp == replayed_until and replayed[log_line] > 0:
+                            replayed[log_line] -= 1
+                            continue
+                        if last_timestamp is None or timestamp > last_timestamp:
+                            last_timestamp = timestamp
+                            last_lines.clear()
+                        if timestamp == last_timestamp:
+                            last_lines[log_line] += 1
+                    yield log_line, timestamp, text
+                else:
+                    # The container stopped writing, e.g. because it restarted; wait a moment before following again.
+                    stop_event.wait(min(1, max(end_time - time.time(), 0)))
+            except (urllib3.exceptions.ReadTimeoutError, urllib3.exceptions.ProtocolError):
+                # A stalled or dropped stream; reconnect from the last line seen until the deadline.
+                pass
+            if time.time() < end_time and not stop_event.is_set():
+                reconnects += 1
+    finally:
+        increment("stream_reconnects_total", reconnects, namespace=namespace, pod=pod_name)
+        if reconnects:
+            logger.debug(f"Log stream of pod {pod_name} in namespace {namespace} was reconnected {reconnects} times")
 
-        except client.exceptions.ApiException as e:
-            logger.error(f"API exception in capturing logs for pod {pod.metadata.name} in namespace {namespace}: {e}")
-        except IOError as io_err:
-            logger.error(f"I/O error writing to file '{log_file_path}': {io_err}")
-        except Exception as e:
-            logger.error(f"Exception in capturing logs for pod {pod.metadata.name} in namespace {namespace}: {e}")
 
+def pod_log_lines(core_v1_api, pod, namespace, start_time, end_time, capture_backend="api", stop_event=None):
+    if capture_backend == "node":
+        pod_log_dir = pod_log_directory(namespace, pod.metadata.name, pod.metadata.uid)
+        if pod_log_dir is not None:
+            return node_log_lines(pod_log_dir, pod.spec.containers[0].name, end_time, namespace, pod.metadata.name,
+                                  stop_event)
+        # Only pods on the node the benchmark runs on have their logs under the mounted directory.
+        logger.warning(f"No node-local logs for pod {pod.metadata.name} in namespace {namespace}, streaming them from the API")
+        increment("node_log_fallbacks_total", namespace=namespace)
+    return api_log_lines(core_v1_api, pod.metadata.name, namespace, start_time, end_time, stop_event)
+
+
+@profiled
+def capture_logs_from_pod(core_v1_api, pod_name, namespace, start_time, end_time, log_dir, live_metrics=None,
+                          write_raw_logs=True, log_compression=None, log_lines=None):
+    log_file_path = os.path.join(log_dir, log_file_name(pod_name, log_compression))
+    metrics = live_metrics.create_pod_metrics(pod_name) if live_metrics is not None else []
+    if log_lines is None:
+        log_lines = api_log_lines(core_v1_api, pod_name, namespace, start_time, end_time)
+    stream_stats = StreamStats()
+    outside_window = 0
+
+    try:
+        with timed("pod_capture", namespace=namespace), closing(log_lines), \
+                (BufferedLogSink(log_file_path, log_compression) if write_raw_logs else nullcontext()) as log_file:
+            try:
+                camera_line = read_camera_line(core_v1_api, pod_name, namespace)
+            except Exception as e:
+                logger.warning(f"Could not read the camera count of pod {pod_name} in namespace {namespace}: {e}")
+                camera_line = None
+            if camera_line is not None:
+                timestamp, text = split_log_timestamp(camera_line)
+                if log_file is not None:
+                    log_file.write_line(camera_line)
+                for metric in metrics:
+                    metric.feed(text, timestamp)
+
+            for log_line, timestamp, text in log_lines:
+                received_at = time.time()
+                lag = None
+                if timestamp is None:
+                    timestamp = received_at
+                else:
+                    lag = received_at - timestamp
+                if timestamp > end_time or received_at > end_time:
+                    break
+                if timestamp < start_time:
+                    outside_window += 1
+                    continue
+
+                if log_file is not None:
+                    log_file.write_line(log_line)
+                for metric in metrics:
+                    metric.feed(text, timestamp)
+                stream_stats.record(len(log_line.encode('utf-8')) + 1, lag)
+
+    except client.exceptions.ApiException as e:
+        increment("stream_failures_total", namespace=namespace, reason="api")
+        logger.error(f"API exception in capturing logs for pod {pod_name} in namespace {namespace}: {e}")
+    except IOError as io_err:
+        increment("stream_failures_total", namespace=namespace, reason="io")
+        logger.error(f"I/O error capturing logs of pod {pod_name} to '{log_file_path}': {io_err}")
+    except Exception as e:
+        increment("stream_failures_total", namespace=namespace, reason="other")
+        logger.error(f"Exception in capturing logs for pod {pod_name} in namespace {namespace}: {e}")
+
+    stream_stats.publish(namespace=namespace, pod=pod_name)
+    increment("lines_outside_window_total", outside_window, namespace=namespace, pod=pod_name)
+    return stream_stats.lines, stream_stats.bytes
+
+
+def capture_logs_from_pods_of_deployment(core_v1_api, deployment, namespace, duration, log_dir, live_metrics=None, write_raw_logs=True,
+                                         log_compression=None, capture_backend="api"):
+    selector = ','.join([f'{k}={v}' for k, v in deployment.spec.selector.match_labels.items()])
+    with timed("pod_listing", namespace=namespace):
+        pods = core_v1_api.list_namespaced_pod(namespace, label_selector=selector)
+
+    start_time = time.time()
+    end_time = start_time + duration
+
+    if not pods.items:
+        logger.warning(f"No pods found for deployment {deployment.metadata.name} in namespace {namespace}")
+        return {}
+
+    capture_stats = {}
+    reserve_log_streams(len(pods.items))
+    try:
+        with ThreadPoolExecutor(max_workers=len(pods.items)) as executor:
+            futures = {executor.submit(capture_logs_from_pod, core_v1_api, pod.metadata.name, namespace, start_time, end_time, log_dir,
+                                       live_metrics, write_raw_logs, log_compression,
+                                       pod_log_lines(core_v1_api, pod, namespace, start_time, end_time, capture_backend)):
+                       pod.metadata.name
+                       for pod in pods.items}
+            for future in as_completed(futures):
+                capture_stats[futures[future]] = future.result()
+    finally:
+        release_log_streams(len(pods.items))
+
+    for pod_name, (line_count, byte_count) in sorted(capture_stats.items()):
+        logger.info(f"Captured {line_count} lines ({byte_count} bytes) from pod {pod_name} in namespace {namespace}")
+
+    return capture_stats
 
-def capture_logs(namespace, duration, log_dir):
+
+def capture_deployment_logs(core_v1_api, deployment, namespace, duration, log_dir, live_metrics=None, write_raw_logs=True,
+                            log_compression=None, capture_backend="api"):
+    started_at = time.time()
+    capture_stats = capture_logs_from_pods_of_deployment(core_v1_api, deployment, namespace, duration, log_dir,
+                                                         live_metrics, write_raw_logs, log_compression, capture_backend)
+    ended_at = time.time()
+    return {"started_at": started_at, "ended_at": ended_at, "pods": capture_stats}
+
+
+def log_capture_windows(namespace, capture_windows):
+    for deployment_name, window in sorted(capture_windows.items()):
+        logger.info(f"Capture window for {deployment_name} in namespace {namespace}: "
+                    f"{time.strftime('%H:%M:%S', time.localtime(window['started_at']))} - "
+                    f"{time.strftime('%H:%M:%S', time.localtime(window['ended_at']))} "
+                    f"({round(window['ended_at'] - window['started_at'], 2)}s)")
+
+    if len(capture_windows) > 1:
+        overlap = min(w["ended_at"] for w in capture_windows.values()) - max(w["started_at"] for w in capture_windows.values())
+        if overlap > 0:
+            logger.info(f"Capture windows in namespace {namespace} overlap for {round(overlap, 2)}s")
+        else:
+            logger.warning(f"Capture windows in namespace {namespace} do not overlap")
+
+
+def capture_logs(namespace, duration, log_dir, max_concurrency=None, live_metrics=None, write_raw_logs=True,
+                 log_compression=None, info_poll_interval=None, capture_backend="api"):
     core_v1_api, apps_v1_api = get_kubernetes_api_client()
+    capture_windows = {}
 
     try:
-        deployments = apps_v1_api.list_namespaced_deployment(namespace)
-        for deployment in deployments.items:
-            pod_log_thread = threading.Thread(target=capture_logs_from_pods_of_deployment, 
-                                              args=(core_v1_api, deployment, namespace, duration, log_dir))
-            pod_log_thread.start()
+        with timed("deployment_listing", namespace=namespace):
+            deployments = apps_v1_api.list_namespaced_deployment(namespace)
+        if not deployments.items:
+            logger.debug(f"No deployments found in namespace {namespace}")
+            return capture_windows
+
+        ids_deployments = [d for d in deployments.items if d.metadata.name.startswith("ids")]
+        max_workers = max_concurrency or len(deployments.items)
+        start_time = time.time()
 
-            if deployment.metadata.name.startswith("ids"):
+        # The IDS info logs get their own threads, so a capped pool cannot start their window after the pod captures'.
+        with ThreadPoolExecutor(max_workers=max(len(ids_deployments), 1)) as info_executor, \
+                ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for deployment in ids_deployments:
                 logger.debug("Capturing additional IDS info logs.")
-                ids_info_log_thread = threading.Thread(target=capture_ids_info_logs, 
-                                                       args=(core_v1_api, deployment, namespace, duration, log_dir))
-                ids_info_log_thread.start()
-                ids_info_log_thread.join()
+                info_executor.submit(capture_ids_info_logs, core_v1_api, deployment, namespace, start_time, duration,
+                                     log_dir, live_metrics, write_raw_logs, log_compression, info_poll_interval)
+
+            futures = {}
+            for deployment in deployments.items:
+                future = executor.submit(capture_deployment_logs, core_v1_api, deployment, namespace, duration, log_dir,
+                                         live_metrics, write_raw_logs, log_compression, capture_backend)
+                futures[future] = deployment.metadata.name
 
-            pod_log_thread.join()
+            for future in as_completed(futures):
+                try:
+                    capture_windows[futures[future]] = future.result()
+                except Exception as e:
+                    logger.error(f"Exception in capturing logs for deployment {futures[future]} in namespace {namespace}: {e}")
+
+        log_capture_windows(namespace, capture_windows)
 
     except client.exceptions.ApiException as e:
         logger.error(f"API exception while listing deployments in namespace {namespace}: {e}")
     except Exception as e:
         logger.error(f"Exception while processing namespace {namespace}: {e}")
 
+    return capture_windows
+
 
-def capture_ids_info_logs(core_v1_api, deployment, namespace, duration, log_dir):
+def follow_pod_logs(core_v1_api, pod, namespace, start_time, log_dir, live_metrics, stop_event, capture_backend="api"):
+    reserve_log_streams(1)
     try:
-        if duration > 1:
-            time.sleep(duration - 1)
+        capture_logs_from_pod(core_v1_api, pod.metadata.name, namespace, start_time, math.inf, log_dir, live_metrics,
+                              False, None,
+                              pod_log_lines(core_v1_api, pod, namespace, start_time, math.inf, capture_backend, stop_event))
+    finally:
+        release_log_streams(1)
+    logger.info(f"Stopped following the logs of pod {pod.metadata.name} in namespace {namespace}")
 
-        label_selector = ','.join([f'{k}={v}' for k, v in deployment.spec.selector.match_labels.items()])
-        pods = core_v1_api.list_namespaced_pod(namespace, label_selector=label_selector)
 
-        for pod in pods.items:
-            command = ["cat", "/var/log/scylla/scylla-info.log"]
-            resp = stream.stream(core_v1_api.connect_get_namespaced_pod_exec,
-                                 name=pod.metadata.name,
-                                 namespace=namespace,
-                                 command=command,
-                                 stderr=True,
-                                 stdin=False,
-                                 stdout=True,
-                                 tty=False)
-
-            info_log_path = os.path.join(log_dir, f"info-{pod.metadata.name}.log")
-            with open(info_log_path, 'w') as info_log_file:
-                info_log_file.write(resp)
-            logger.debug(f"IDS info log captured and saved for pod: {pod.metadata.name}")
+def follow_logs(namespace, log_dir, live_metrics, interval, stop_event, info_poll_interval=None, capture_backend="api"):
+    # Captures that never end: the pods are listed again every interval and each running pod without a live
+    # capture gets one, so pods replacing deleted or evicted ones are followed without a restart.
+    core_v1_api, apps_v1_api = get_kubernetes_api_client()
+    captures = {}
+    listed_at = None
+    try:
+        while True:
+            try:
+                with timed("deployment_listing", namespace=namespace):
+                    deployments = apps_v1_api.list_namespaced_deployment(namespace)
+                pods = {}
+                for deployment in deployments.items:
+                    selector = ','.join([f'{k}={v}' for k, v in deployment.spec.selector.match_labels.items()])
+                    with timed("pod_listing", namespace=namespace):
+                        for pod in core_v1_api.list_namespaced_pod(namespace, label_selector=selector).items:
+                            pods[pod.metadata.name] = (deployment, pod)
+            except client.exceptions.ApiException as e:
+                logger.error(f"API exception while listing pods in namespace {namespace}: {e}")
+                pods = None
+
+            if pods is not None:
+                now = time.time()
+                for pod_name in [p for p in captures if p not in pods]:
+                    captures.pop(pod_name)[1].set()
+                for pod_name, (deployment, pod) in sorted(pods.items()):
+                    if pod.status.phase != "Running" or pod.metadata.deletion_timestamp is not None:
+                        continue
+                    capture = captures.get(pod_name)
+                    if capture is not None and capture[0].is_alive():
+                        continue
+                    # A pod that appeared since the last listing is read from that listing on, so its first lines
+                    # are not lost; a capture that ended is resumed from now, so no line is counted twice.
+                    start_time = listed_at if capture is None and listed_at is not None else now
+                    pod_stop = capture[1] if capture is not None else threading.Event()
+                    threads = [threading.Thread(target=follow_pod_logs, daemon=True,
+                                                args=(core_v1_api, pod, namespace, start_time, log_dir, live_metrics,
+                                                      pod_stop, capture_backend))]
+                    if capture is None and deployment.metadata.name.startswith("ids"):
+                        threads.append(threading.Thread(
+                            target=capture_ids_info_logs, daemon=True,
+                            args=(core_v1_api, deployment, namespace, start_time, math.inf, log_dir, live_metrics,
+                                  False, None, info_poll_interval, [pod], pod_stop)))
+                    for thread in threads:
+                        thread.start()
+                    captures[pod_name] = (threads[0], pod_stop)
+                    increment("pod_captures_started_total", namespace=namespace)
+                    logger.info(f"{'Resumed' if capture is not None else 'Started'} following the logs of pod "
+                                f"{pod_name} in namespace {namespace}")
+                listed_at = now
+
+            if stop_event.wait(interval):
+                break
+    finally:
+        for _, pod_stop in captures.values():
+            pod_stop.set()
+
+
+def exec_in_pod(exec_api, pod_name, namespace, command, on_stdout=None, binary=False):
+    # With binary=True stdout arrives as the raw bytes the command wrote, not decoded text.
+    resp = stream.stream(exec_api.connect_get_namespaced_pod_exec,
+                         name=pod_name,
+                         namespace=namespace,
+                         command=command,
+                         stderr=True,
+                         stdin=False,
+                         stdout=True,
+                         tty=False,
+                         binary=binary,
+                         _preload_content=False)
+    output = []
+    try:
+        while True:
+            is_open = resp.is_open()
+            if is_open:
+                resp.update(timeout=1)
+            stdout = resp.read_stdout(timeout=0) if resp.peek_stdout() else None
+            if stdout:
+                if on_stdout is not None:
+                    on_stdout(stdout)
+                else:
+                    output.append(stdout)
+            if resp.peek_stderr():
+                stderr = resp.read_stderr()
+                if binary:
+                    stderr = stderr.decode('utf-8', errors='replace')
+                logger.debug(f"{' '.join(command)} in pod {pod_name}: {stderr.strip()}")
+            if not is_open:
+                break
+    finally:
+        resp.close()
+    return (b'' if binary else '').join(output)
+
+
+def info_log_size(exec_api, pod_name, namespace):
+    output = exec_in_pod(exec_api, pod_name, namespace, ["wc", "-c", IDS_INFO_LOG]).split()
+    return int(output[0]) if output and output[0].isdigit() else 0
+
+
+def tail_info_log(exec_api, pod_name, namespace, offset, on_lines, include_partial=True):
+    if info_log_size(exec_api, pod_name, namespace) < offset:
+        logger.debug(f"IDS info log of pod {pod_name} was truncated or rotated during the window, reading it from the start")
+        offset = 0
+
+    # Offsets count the bytes tail returned, so a multi-byte or invalid character cannot shift the next read.
+    pending = [b""]
+    consumed = [0]
+
+    def split_lines(chunk):
+        lines = (pending[0] + chunk).split(b'\n')
+        pending[0] = lines.pop()
+        if lines:
+            consumed[0] += sum(len(line) + 1 for line in lines)
+            on_lines([line.decode('utf-8', errors='replace') for line in lines])
+
+    exec_in_pod(exec_api, pod_name, namespace, ["tail", "-c", f"+{offset + 1}", IDS_INFO_LOG], split_lines, binary=True)
+    # A line still being written is left for the next read unless this is the last one.
+    if pending[0] and include_partial:
+        consumed[0] += len(pending[0])
+        on_lines([pending[0].decode('utf-8', errors='replace')])
+    return offset + consumed[0]
+
+
+@profiled
+def capture_ids_info_logs(core_v1_api, deployment, namespace, start_time, duration, log_dir, live_metrics=None,
+                          write_raw_logs=True, log_compression=None, poll_interval=None, pods=None, stop_event=None):
+    try:
+        end_time = start_time + duration
+        stop_event = stop_event or threading.Event()
+        if pods is None:
+            label_selector = ','.join([f'{k}={v}' for k, v in deployment.spec.selector.match_labels.items()])
+            with timed("pod_listing", namespace=namespace):
+                pods = core_v1_api.list_namespaced_pod(namespace, label_selector=label_selector).items
+        exec_api = get_kubernetes_exec_api()
+
+        # Remember where each info log ends when the window opens, so only the bytes written during it are read.
+        offsets = {}
+        for pod in pods:
+            try:
+                offsets[pod.metadata.name] = info_log_size(exec_api, pod.metadata.name, namespace)
+            except Exception as e:
+                logger.error(f"Could not read the IDS info log size of pod {pod.metadata.name}: {e}")
+
+        with ExitStack() as stack:
+            consumers = {}
+            for pod_name in offsets:
+                metrics = live_metrics.create_info_metrics(pod_name) if live_metrics is not None else []
+                info_log_path = os.path.join(log_dir, log_file_name(f"info-{pod_name}", log_compression))
+                info_log_file = stack.enter_context(BufferedLogSink(info_log_path, log_compression)) if write_raw_logs else None
+
+                def on_lines(lines, metrics=metrics, info_log_file=info_log_file):
+                    feed_lines(lines, metrics, time.time())
+                    if info_log_file is not None:
+                        for line in lines:
+                            info_log_file.write_line(line)
+
+                consumers[pod_name] = on_lines
+
+            # Without a poll interval the logs are read once when the window closes; otherwise every poll_interval.
+            while True:
+                remaining = end_time - time.time()
+                if remaining > 0:
+                    stop_event.wait(remaining if poll_interval is None else min(poll_interval, remaining))
+                last_read = time.time() >= end_time or stop_event.is_set()
+                for pod_name, offset in offsets.items():
+                    try:
+                        offsets[pod_name] = tail_info_log(exec_api, pod_name, namespace, offset, consumers[pod_name],
+                                                          include_partial=last_read)
+                    except Exception as e:
+                        logger.error(f"Could not read the IDS info log of pod {pod_name}: {e}")
+                if last_read:
+                    break
+
+        for pod_name, offset in offsets.items():
+            logger.debug(f"IDS info log captured for pod: {pod_name} up to byte {offset}")
 
     except Exception as e:
         logger.error(f"Error in capture_ids_info_logs: {e}")
+
+
+def discover_pods(namespaces):
+    # One listing per namespace gives both the node each pod runs on and the images it runs.
+    core_v1_api, _ = get_kubernetes_api_client()
+    pod_nodes = {}
+    pod_images = {}
+    for namespace in namespaces:
+        try:
+            pods = core_v1_api.list_namespaced_pod(namespace)
+        except client.exceptions.ApiException as e:
+            logger.error(f"API exception while listing pods in namespace {namespace}: {e}")
+            continue
+        for pod in pods.items:
+            if pod.spec.node_name:
+                pod_nodes[pod.metadata.name] = pod.spec.node_name
+            pod_images[pod.metadata.name] = ";".join(container.image for container in pod.spec.containers)
+    return pod_nodes, pod_images
+
+
+def resolve_node_addresses(node_names):
+    core_v1_api, _ = get_kubernetes_api_client()
+    node_addresses = {}
+    for node_name in sorted(node_names):
+        try:
+            node = core_v1_api.read_node(node_name)
+            addresses = {a.type: a.address for a in node.status.addresses or []}
+            node_addresses[node_name] = addresses.get("InternalIP") or addresses.get("ExternalIP") or node_name
+        except client.exceptions.ApiException as e:
+            logger.error(f"API exception while reading node {node_name}: {e}")
+    return node_addresses
+
+
+def watch_until(list_fn, predicate, deadline, **kwargs):
+    # Lists the objects and follows their changes until predicate holds for them by name. Returns them, or None
+    # once the deadline passes.
+    objects = {}
+    resource_version = None
+    while True:
+        if resource_version is None:
+            listing = list_fn(**kwargs)
+            objects = {o.metadata.name: o for o in listing.items}
+            resource_version = listing.metadata.resource_version
+        if predicate(objects):
+            return objects
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return None
+
+        w = watch.Watch()
+        try:
+            for event in w.stream(list_fn, resource_version=resource_version, timeout_seconds=max(int(remaining), 1),
+                                  **kwargs):
+                obj = event["object"]
+                resource_version = obj.metadata.resource_version
+                if event["type"] == "DELETED":
+                    objects.pop(obj.metadata.name, None)
+                else:
+                    objects[obj.metadata.name] = obj
+                if predicate(objects):
+                    w.stop()
+                    return objects
+        except client.exceptions.ApiException as e:
+            if e.status != 410:
+                raise
+            # The watched resource version expired, so list again and restart the watch from there.
+            resource_version = None
+
+
+def rollout_complete(deployment):
+    status = deployment.status
+    replicas = deployment.spec.replicas or 0
+    return (status.observed_generation or 0) >= deployment.metadata.generation \
+        and (status.updated_replicas or 0) == replicas \
+        and (status.available_replicas or 0) == replicas \
+        and (status.replicas or 0) == replicas
+
+
+def wait_for_rollout(apps_v1_api, deployment_name, namespace, timeout):
+    deployments = watch_until(apps_v1_api.list_namespaced_deployment,
+                              lambda deployments: any(rollout_complete(d) for d in deployments.values()),
+                              time.time() + timeout, namespace=namespace, field_selector=f"metadata.name={deployment_name}")
+    if deployments is None:
+        logger.error(f"Deployment {deployment_name} in namespace {namespace} did not finish rolling out within {timeout}s")
+        return False
+    return True
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+import os
+import threading
+
+import urllib3
+from kubernetes import client, config
+
+from logg import logger
+
+CONNECTION_POOL_HEADROOM = 4
+
+_client_lock = threading.Lock()
+_api_client = None
+_active_streams = 0
+_pool_stats_lock = threading.Lock()
+_pool_stats = {"hits": 0, "misses": 0, "waits": 0, "discards": 0}
+
+
+def record_pool_event(event):
+    with _pool_stats_lock:
+        _pool_stats[event] += 1
+
+
+def get_connection_pool_stats():
+    with _pool_stats_lock:
+        return dict(_pool_stats)
+
+
+class CountingConnectionPoolMixin:
+    # hits reuse an idle connection, misses open a new one and waits find every
+    # slot of the pool checked out (those connections get discarded on return).
+    def _get_conn(self, timeout=None):
+        exhausted = self.pool is not None and self.pool.empty()
+        num_connections = self.num_connections
+        conn = super()._get_conn(timeout=timeout)
+        if exhausted:
+            record_pool_event("waits")
+        record_pool_event("misses" if self.num_connections > num_connections else "hits")
+        return conn
+
+    def _put_conn(self, conn):
+        if self.pool is not None and self.pool.full():
+            record_pool_event("discards")
+        super()._put_conn(conn)
+
+    def grow(self, maxsize):
+        if self.pool is None or maxsize <= self.pool.maxsize:
+            return
+        extra = maxsize - self.pool.maxsize
+        self.pool.maxsize = maxsize
+        for _ in range(extra):
+            self.pool.put(None, block=False)
+
+
+class CountingHTTPConnectionPool(CountingConnectionPoolMixin, urllib3.HTTPConnectionPool):
+    pass
+
+
+class CountingHTTPSConnectionPool(CountingConnectionPoolMixin, urllib3.HTTPSConnectionPool):
+    pass
+
+
+def _create_api_client():
+    api_host = os.getenv('K8S_API_HOST')
+    if api_host:
+        configuration = client.Configuration()
+        configuration.host = api_host
+    else:
+        config.load_incluster_config()
+        configuration = client.Configuration.get_default_copy()
+    configuration.connection_pool_maxsize = int(os.getenv('K8S_CONNECTION_POOL_SIZE', 0)) or CONNECTION_POOL_HEADROOM
+    api_client = client.ApiClient(configuration)
+
+    pool_manager = api_client.rest_client.pool_manager
+    pool_manager.pool_classes_by_scheme = {"http": CountingHTTPConnectionPool, "https": CountingHTTPSConnectionPool}
+    logger.debug(f"Created shared Kubernetes API client with connection pool size {configuration.connection_pool_maxsize}")
+    return api_client
+
+
+def get_shared_api_client():
+    global _api_client
+    with _client_lock:
+        if _api_client is None:
+            _api_client = _create_api_client()
+        return _api_client
+
+
+def get_kubernetes_api_client():
+    api_client = get_shared_api_client()
+    return client.CoreV1Api(api_client), client.AppsV1Api(api_client)
+
+
+def get_kubernetes_exec_api():
+    # stream.stream swaps ApiClient.request for a websocket call while it runs, so
+    # exec requests get their own ApiClient to keep that swap away from other threads.
+    return client.CoreV1Api(client.ApiClient(get_shared_api_client().configuration))
+
+
+def _resize_connection_pool(api_client, maxsize):
+    pool_manager = api_client.rest_client.pool_manager
+    if maxsize <= pool_manager.connection_pool_kw.get("maxsize", 0):
+        return
+    pool_manager.connection_pool_kw["maxsize"] = maxsize
+    for key in pool_manager.pools.keys():
+        pool = pool_manager.pools.get(key)
+        if isinstance(pool, CountingConnectionPoolMixin):
+            pool.grow(maxsize)
+    logger.debug(f"Resized Kubernetes API connection pool to {maxsize}")
+
+
+def reserve_log_streams(count):
+    global _active_streams
+    api_client = get_shared_api_client()
+    with _client_lock:
+        _active_streams += count
+        _resize_connection_pool(api_client, _active_streams + CONNECTION_POOL_HEADROOM)
+
+
+def release_log_streams(count):
+    global _active_streams
+    with _client_lock:
+        _active_streams = max(_active_streams - count, 0)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+import gzip
+import io
+import os
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FLUSH_BYTES = 256 * 1024
+FLUSH_INTERVAL = 1.0
+GZIP_LEVEL = 1
+ZSTD_LEVEL = 3
+
+LOG_FILE_EXTENSIONS = {
+    None: ".log",
+    "gzip": ".log.gz",
+    "zstd": ".log.zst",
+}
+
+
+def validate_compression(compression):
+    if compression not in LOG_FILE_EXTENSIONS:
+        raise ValueError(f"Invalid log compression: {compression}")
+    if compression == "zstd" and zstandard is None:
+        raise ValueError("zstd log compression requires the zstandard package")
+
+
+def log_file_name(name, compression=None):
+    return f"{name}{LOG_FILE_EXTENSIONS[compression]}"
+
+
+def strip_log_extension(file_name):
+    for extension in sorted(LOG_FILE_EXTENSIONS.values(), key=len, reverse=True):
+        if file_name.endswith(extension):
+            return file_name[:-len(extension)]
+    return file_name
+
+
+def open_log_file(path):
+    if path.endswith(LOG_FILE_EXTENSIONS["gzip"]):
+        return gzip.open(path, 'rt', errors='replace')
+    if path.endswith(LOG_FILE_EXTENSIONS["zstd"]):
+        if zstandard is None:
+            raise IOError(f"Cannot read '{path}' without the zstandard package")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+        return io.TextIOWrapper(reader, errors='replace')
+    return open(path, 'r')
+
+
+class BufferedLogSink:
+    def __init__(self, path, compression=None, flush_bytes=FLUSH_BYTES, flush_interval=FLUSH_INTERVAL):
+        validate_compression(compression)
+        self.path = path
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.buffered_bytes = 0
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+
+        self.raw_file = open(path, 'wb')
+        if compression == "gzip":
+            self.file = gzip.GzipFile(fileobj=self.raw_file, mode='wb', compresslevel=GZIP_LEVEL)
+        elif compression == "zstd":
+            self.file = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(self.raw_file, closefd=False)
+        else:
+            self.file = self.raw_file
+
+        # Flushing on a timer instead of in write() keeps a quiet pod's last lines from waiting for its next one.
+        self.flusher = threading.Thread(target=self.flush_periodically, daemon=True)
+        self.flusher.start()
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        with self.lock:
+            self.buffer.append(data)
+            self.buffered_bytes += len(data)
+            self.dirty = True
+            if self.buffered_bytes >= self.flush_bytes:
+                self.write_buffer()
+
+    def write_line(self, line):
+        self.write(line + '\n')
+
+    def write_buffer(self):
+        if self.buffer:
+            self.file.write(b''.join(self.buffer))
+            self.buffer.clear()
+            self.buffered_bytes = 0
+
+    def flush(self):
+        with self.lock:
+            self.write_buffer()
+            if self.dirty:
+                self.file.flush()
+                if self.file is not self.raw_file:
+                    self.raw_file.flush()
+                self.dirty = False
+
+    def flush_periodically(self):
+        while not self.closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except (OSError, ValueError):
+                # The error comes up again in the next write or in close(), in the capturing thread.
+                return
+
+    def close(self):
+        self.closed.set()
+        self.flusher.join()
+        try:
+            with self.lock:
+                self.write_buffer()
+            if self.file is not self.raw_file:
+                self.file.close()
+            self.raw_file.flush()
+            os.fsync(self.raw_file.fileno())
+        finally:
+            self.raw_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+# Reads container logs straight from the kubelet's log directory on the node, which has to be
+# mounted into the benchmark pod, instead of streaming them through the API server.
+
+import os
+import re
+import threading
+import time
+
+from calculations import split_log_timestamp
+from logg import logger
+from telemetry import increment
+
+POD_LOG_ROOT = "/var/log/pods"
+POLL_INTERVAL = 0.1
+READ_BYTES = 1024 * 1024
+# Lines logged just before the window opened may still be unwritten, so reading starts a little before the end.
+BACKFILL_BYTES = 64 * 1024
+LOG_FILE_PATTERN = re.compile(r'^(\d+)\.log$')
+
+
+def parse_cri_line(line):
+    # <RFC 3339 timestamp> <stdout|stderr> <P|F>[:more tags] <message>
+    parts = line.split(' ', 3)
+    if len(parts) < 3 or parts[1] not in ("stdout", "stderr"):
+        return None
+    timestamp, stream, tags = parts[:3]
+    return timestamp, stream, tags.split(':', 1)[0], parts[3] if len(parts) > 3 else ""
+
+
+def pod_log_directory(namespace, pod_name, pod_uid, root=POD_LOG_ROOT):
+    path = os.path.join(root, f"{namespace}_{pod_name}_{pod_uid}")
+    return path if os.path.isdir(path) else None
+
+
+def latest_log_file(container_dir):
+    # Every container restart gets a new <restart count>.log; rotated files carry a suffix after .log.
+    restarts = []
+    try:
+        for name in os.listdir(container_dir):
+            match = LOG_FILE_PATTERN.match(name)
+            if match:
+                restarts.append((int(match.group(1)), name))
+    except FileNotFoundError:
+        return None
+    return os.path.join(container_dir, max(restarts)[1]) if restarts else None
+
+
+class LogFileFollower:
+    def __init__(self, path, backfill_bytes=0):
+        self.path = path
+        self.pending = b""
+        self.open(backfill_bytes)
+
+    def open(self, backfill_bytes=0):
+        self.file = open(self.path, 'rb')
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        size = os.fstat(self.file.fileno()).st_size
+        if backfill_bytes and size > backfill_bytes:
+            self.file.seek(size - backfill_bytes)
+            self.file.readline()
+        elif not backfill_bytes:
+            self.file.seek(size)
+
+    def read_lines(self):
+        data = self.file.read(READ_BYTES)
+        if not data:
+            return []
+        lines = (self.pending + data).split(b'\n')
+        self.pending = lines.pop()
+        return [line.decode('utf-8', errors='replace') for line in lines]
+
+    def rotated(self):
+        # The runtime creates the new file when it reopens the log, so a new inode means the old one is finished.
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except FileNotFoundError:
+            return False
+
+    def truncated(self):
+        return os.fstat(self.file.fileno()).st_size < self.file.tell()
+
+    def reopen(self, path=None):
+        if self.pending:
+            logger.debug(f"Dropping an unterminated line at the end of {self.path}")
+        self.close()
+        self.path = path or self.path
+        self.pending = b""
+        self.file = open(self.path, 'rb')
+        self.inode = os.fstat(self.file.fileno()).st_ino
+
+    def close(self):
+        self.file.close()
+
+
+def node_log_lines(pod_log_dir, container_name, end_time, namespace=None, pod_name=None, stop_event=None):
+    stop_event = stop_event or threading.Event()
+    container_dir = os.path.join(pod_log_dir, container_name)
+    path = latest_log_file(container_dir)
+    if path is None:
+        raise FileNotFoundError(f"No log file for container {container_name} in {pod_log_dir}")
+
+    follower = LogFileFollower(path, BACKFILL_BYTES)
+    partial = []
+    rotations = restarts = malformed = 0
+    try:
+        while time.time() < end_time and not stop_event.is_set():
+            lines = follower.read_lines()
+            if not lines:
+                newer = latest_log_file(container_dir)
+                if newer is not None and newer != follower.path:
+                    # The container restarted; the old file is drained, so continue with the new one from its start.
+                    follower.reopen(newer)
+                    restarts += 1
+                elif follower.rotated():
+                    follower.reopen()
+                    rotations += 1
+                elif follower.truncated():
+                    follower.reopen()
+                    rotations += 1
+                else:
+                    stop_event.wait(min(POLL_INTERVAL, max(end_time - time.time(), 0)))
+                continue
+
+            for raw_line in lines:
+                parsed = parse_cri_line(raw_line)
+                if parsed is None:
+                    malformed += 1
+                    continue
+                timestamp, _, tag, message = parsed
+                # Long lines are split into P(artial) records that end with an F(ull) one.
+                if tag == "P":
+                    partial.append(message)
+                    continue
+                if partial:
+                    message = ''.join(partial) + message
+                    partial.clear()
+                log_line = f"{timestamp} {message}"
+                timestamp, text = split_log_timestamp(log_line)
+                yield log_line, timestamp, text
+    finally:
+        follower.close()
+        increment("log_file_rotations_total", rotations, namespace=namespace, pod=pod_name)
+        increment("container_restarts_total", restarts, namespace=namespace, pod=pod_name)
+        increment("malformed_log_lines_total", malformed, namespace=namespace, pod=pod_name)
+        if rotations or restarts:
+            logger.debug(f"Log files of pod {pod_name} were rotated {rotations} times and switched after {restarts} restarts")
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from kubernetes import client, watch
+
+from logg import logger
+from k8s import wait_for_rollout, watch_until
+from k8s_client import get_kubernetes_api_client, reserve_log_streams, release_log_streams
+from deployment_processing import deployments_mapping, pod_deployment_name
+
+MARKER_LOOKBACK_SECONDS = 60
+
+
+def steady_state_patterns(deployment_name, marker=None):
+    if marker:
+        return [re.compile(marker)]
+    # Without an explicit marker, the first line any of the deployment's metrics can parse means it is processing.
+    patterns = []
+    for metric_class in deployments_mapping.get(pod_deployment_name(deployment_name), []):
+        if metric_class.log_source != "pod":
+            continue
+        if hasattr(metric_class, "steady_state_pattern"):
+            patterns.append(metric_class.steady_state_pattern)
+            continue
+        patterns += [getattr(metric_class, name) for name in ("pattern", "load_pattern", "sample_pattern")
+                     if hasattr(metric_class, name)]
+    return patterns
+
+
+def pod_ready(pod):
+    if pod.metadata.deletion_timestamp is not None or pod.status.phase != "Running":
+        return False
+    return any(c.type == "Ready" and c.status == "True" for c in pod.status.conditions or [])
+
+
+def wait_for_pods_ready(core_v1_api, deployment, namespace, deadline):
+    selector = ','.join([f'{k}={v}' for k, v in deployment.spec.selector.match_labels.items()])
+    replicas = deployment.spec.replicas or 0
+
+    # Pods of the previous ReplicaSet can linger while terminating, so wait for exactly the desired ready set.
+    pods = watch_until(core_v1_api.list_namespaced_pod,
+                       lambda pods: len(pods) == replicas and all(pod_ready(pod) for pod in pods.values()),
+                       deadline, namespace=namespace, label_selector=selector)
+    return sorted(pods) if pods is not None else None
+
+
+def wait_for_log_marker(core_v1_api, pod_name, namespace, patterns, deadline):
+    if not patterns:
+        return True
+
+    w = watch.Watch()
+    try:
+        for log_line in w.stream(core_v1_api.read_namespaced_pod_log, name=pod_name, namespace=namespace,
+                                 since_seconds=MARKER_LOOKBACK_SECONDS,
+                                 _request_timeout=max(deadline - time.time(), 1)):
+            if any(pattern.search(log_line) for pattern in patterns):
+                w.stop()
+                return True
+            if time.time() > deadline:
+                w.stop()
+                break
+    except Exception as e:
+        logger.debug(f"Stopped waiting for the steady-state marker of pod {pod_name} in namespace {namespace}: {e}")
+    return False
+
+
+def wait_for_deployment(core_v1_api, apps_v1_api, deployment, namespace, deadline, marker=None):
+    deployment_name = deployment.metadata.name
+    started_at = time.time()
+    timings = {"rollout": None, "marker": None, "ready": False}
+
+    if not wait_for_rollout(apps_v1_api, deployment_name, namespace, max(deadline - time.time(), 0)):
+        return timings
+    deployment = apps_v1_api.read_namespaced_deployment(deployment_name, namespace)
+    pod_names = wait_for_pods_ready(core_v1_api, deployment, namespace, deadline)
+    timings["rollout"] = time.time() - started_at
+    if pod_names is None:
+        logger.warning(f"Pods of deployment {deployment_name} in namespace {namespace} did not become ready in time")
+        return timings
+
+    patterns = steady_state_patterns(deployment_name, marker)
+    marker_started_at = time.time()
+    if pod_names:
+        reserve_log_streams(len(pod_names))
+        try:
+            with ThreadPoolExecutor(max_workers=len(pod_names)) as executor:
+                found = list(executor.map(lambda pod_name: wait_for_log_marker(core_v1_api, pod_name, namespace, patterns, deadline),
+                                          pod_names))
+        finally:
+            release_log_streams(len(pod_names))
+        missing = [pod_name for pod_name, ok in zip(pod_names, found) if not ok]
+        if missing:
+            logger.warning(f"No steady-state marker seen in the logs of pods {missing} in namespace {namespace}")
+            return timings
+
+    timings["marker"] = time.time() - marker_started_at
+    timings["ready"] = True
+    return timings
+
+
+def wait_for_steady_state(namespaces, timeout, warmup_seconds=0, marker=None):
+    core_v1_api, apps_v1_api = get_kubernetes_api_client()
+    started_at = time.time()
+    deadline = started_at + timeout
+    deployment_timings = {}
+
+    targets = []
+    for namespace in namespaces:
+        try:
+            targets += [(namespace, d) for d in apps_v1_api.list_namespaced_deployment(namespace).items]
+        except client.exceptions.ApiException as e:
+            logger.error(f"API exception while listing deployments in namespace {namespace}: {e}")
+
+    if targets:
+        with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+            futures = {executor.submit(wait_for_deployment, core_v1_api, apps_v1_api, deployment, namespace, deadline, marker):
+                       f"{namespace}/{deployment.metadata.name}" for namespace, deployment in targets}
+            for future, name in futures.items():
+                try:
+                    deployment_timings[name] = future.result()
+                except Exception as e:
+                    logger.error(f"Exception while waiting for deployment {name} to become ready: {e}")
+                    deployment_timings[name] = {"rollout": None, "marker": None, "ready": False}
+
+    ready_at = time.time()
+    for name, timings in sorted(deployment_timings.items()):
+        if timings["ready"]:
+            logger.info(f"{name} ready after {round(timings['rollout'], 2)}s rollout and "
+                        f"{round(timings['marker'], 2)}s waiting for the steady-state marker")
+        else:
+            logger.warning(f"{name} was not in steady state within {timeout}s, its metrics may include startup noise")
+
+    if warmup_seconds > 0:
+        logger.info(f"Warming up for {warmup_seconds}s before the measured window.")
+        time.sleep(warmup_seconds)
+
+    waited = {
+        "readiness": ready_at - started_at,
+        "warmup": time.time() - ready_at,
+        "total": time.time() - started_at,
+        "deployments": deployment_timings,
+    }
+    logger.info(f"Waited {round(waited['total'], 2)}s before the measured window "
+                f"({round(waited['readiness'], 2)}s readiness, {round(waited['warmup'], 2)}s warm-up)")
+    return waited
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+import json
+import math
+import time
+from statistics import NormalDist
+
+from logg import logger
+from result_store import open_result_store, HARDWARE_COLUMNS
+
+# +1 when a larger value is worse, -1 when a smaller one is.
+METRIC_DIRECTIONS = {
+    "calculate_average_load": 1,
+    "calculate_queue_size": 1,
+    "calculate_fps": -1,
+}
+HARDWARE_DIRECTIONS = {column: 1 for column in HARDWARE_COLUMNS}
+
+PASS = "pass"
+FAIL = "fail"
+NO_BASELINE = "no_baseline"
+
+
+def pool_statistics(rows):
+    # rows are (count, mean, stddev) per run; returns the pooled sample statistics and the spread between run means.
+    rows = [(count, mean, stddev or 0.0) for count, mean, stddev in rows if count and mean is not None]
+    if not rows:
+        return None
+    total = sum(count for count, _, _ in rows)
+    mean = sum(count * run_mean for count, run_mean, _ in rows) / total
+    within = sum((count - 1) * stddev ** 2 + count * (run_mean - mean) ** 2 for count, run_mean, stddev in rows)
+    run_means = [run_mean for _, run_mean, _ in rows]
+    grand_mean = sum(run_means) / len(run_means)
+    between = sum((m - grand_mean) ** 2 for m in run_means) / (len(run_means) - 1) if len(run_means) > 1 else 0.0
+    return {"runs": len(rows), "count": total, "mean": mean,
+            "variance": within / (total - 1) if total > 1 else 0.0, "between_variance": between}
+
+
+def compare_means(current, baseline, direction, z, threshold):
+    difference = current["mean"] - baseline["mean"]
+    # Run-to-run variation applies to the current run as well as to the baseline average.
+    standard_error = math.sqrt(current["variance"] / max(current["count"], 1)
+                               + baseline["variance"] / max(baseline["count"], 1)
+                               + baseline["between_variance"] * (1 + 1 / baseline["runs"]))
+    low, high = difference - z * standard_error, difference + z * standard_error
+    relative_change = difference / abs(baseline["mean"]) if baseline["mean"] else None
+    significant = low > 0 or high < 0
+    large_enough = relative_change is None or abs(relative_change) >= threshold
+    worse = difference * direction > 0
+    return {
+        "current_mean": current["mean"],
+        "baseline_mean": baseline["mean"],
+        "baseline_runs": baseline["runs"],
+        "difference": difference,
+        "relative_change": relative_change,
+        "ci_low": low,
+        "ci_high": high,
+        "regression": significant and large_enough and worse,
+        "improvement": significant and large_enough and not worse,
+    }
+
+
+def load_metric_rows(connection, run_id, deployment_name, metric_name, camera_number, baseline_runs):
+    current = connection.execute(
+        "SELECT count, mean, stddev FROM pod_metrics WHERE run_id = ? AND deployment = ? AND metric = ? AND pod = '*'",
+        [run_id, deployment_name, metric_name]).fetchall()
+    # Runs with a different camera count measure a different load, so they are not a baseline.
+    baseline = connection.execute(
+        "SELECT m.count, m.mean, m.stddev FROM pod_metrics m JOIN runs r ON r.run_id = m.run_id "
+        "WHERE m.deployment = ? AND m.metric = ? AND m.pod = '*' AND m.run_id != ? AND m.count > 0 "
+        "AND m.camera_number IS ? AND r.started_at < (SELECT started_at FROM runs WHERE run_id = ?) "
+        "ORDER BY r.started_at DESC LIMIT ?",
+        [deployment_name, metric_name, run_id, camera_number, run_id, baseline_runs]).fetchall()
+    return current, baseline
+
+
+def compare_metrics(connection, run_id, baseline_runs, z, threshold):
+    comparisons = []
+    targets = connection.execute(
+        "SELECT DISTINCT deployment, metric, camera_number FROM pod_metrics WHERE run_id = ? AND pod = '*' AND count > 0",
+        [run_id]).fetchall()
+    for deployment_name, metric_name, camera_number in targets:
+        direction = METRIC_DIRECTIONS.get(metric_name)
+        if direction is None:
+            continue
+        current_rows, baseline_rows = load_metric_rows(connection, run_id, deployment_name, metric_name, camera_number,
+                                                       baseline_runs)
+        current, baseline = pool_statistics(current_rows), pool_statistics(baseline_rows)
+        if current is None or baseline is None:
+            continue
+        comparison = compare_means(current, baseline, direction, z, threshold)
+        comparisons.append({"scope": "deployment", "name": deployment_name, "metric": metric_name, **comparison})
+    return comparisons
+
+
+def compare_hardware(connection, run_id, baseline_runs, z, threshold):
+    # Only per-run averages are stored for hardware, so the baseline spread is the spread between runs.
+    comparisons = []
+    current_rows = connection.execute(f"SELECT node, {', '.join(HARDWARE_COLUMNS)} FROM node_hardware WHERE run_id = ?",
+                                      [run_id]).fetchall()
+    for node, *values in current_rows:
+        baseline_rows = connection.execute(
+            f"SELECT {', '.join('h.' + c for c in HARDWARE_COLUMNS)} FROM node_hardware h JOIN runs r ON r.run_id = h.run_id "
+            "WHERE h.node IS ? AND h.run_id != ? AND r.started_at < (SELECT started_at FROM runs WHERE run_id = ?) "
+            "ORDER BY r.started_at DESC LIMIT ?",
+            [node, run_id, run_id, baseline_runs]).fetchall()
+        for index, column in enumerate(HARDWARE_COLUMNS):
+            baseline_values = [row[index] for row in baseline_rows if row[index] is not None]
+            if values[index] is None or len(baseline_values) < 2:
+                continue
+            baseline = pool_statistics([(1, v, 0.0) for v in baseline_values])
+            current = {"count": 1, "mean": values[index], "variance": 0.0}
+            comparison = compare_means(current, baseline, HARDWARE_DIRECTIONS[column], z, threshold)
+            comparisons.append({"scope": "node", "name": node, "metric": column, **comparison})
+    return comparisons
+
+
+def compare_run(results_db, run_id, baseline_runs=5, confidence=0.95, threshold=0.05):
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    connection = open_result_store(results_db)
+    try:
+        comparisons = compare_metrics(connection, run_id, baseline_runs, z, threshold)
+        comparisons += compare_hardware(connection, run_id, baseline_runs, z, threshold)
+    finally:
+        connection.close()
+
+    if not comparisons:
+        verdict = NO_BASELINE
+    elif any(c["regression"] for c in comparisons):
+        verdict = FAIL
+    else:
+        verdict = PASS
+
+    return {
+        "run_id": run_id,
+        "timestamp": time.strftime('%Y-%m-%d %H:%M:%S'),
+        "verdict": verdict,
+        "confidence": confidence,
+        "threshold": threshold,
+        "baseline_runs": baseline_runs,
+        "comparisons": comparisons,
+    }
+
+
+def log_verdict(verdict):
+    for comparison in verdict["comparisons"]:
+        if comparison["regression"] or comparison["improvement"]:
+            change = comparison["relative_change"]
+            log = logger.warning if comparison["regression"] else logger.info
+            log(f"{'Regression' if comparison['regression'] else 'Improvement'} in {comparison['metric']} of "
+                f"{comparison['scope']} {comparison['name']}: {round(comparison['current_mean'], 2)} vs baseline "
+                f"{round(comparison['baseline_mean'], 2)} over {comparison['baseline_runs']} runs"
+                + (f" ({round(change * 100, 1)}%)" if change is not None else ""))
+    logger.info(f"Regression verdict for run {verdict['run_id']}: {verdict['verdict']} "
+                f"({len(verdict['comparisons'])} comparisons)")
+
+
+def write_verdict(verdict_file, verdict):
+    with open(verdict_file, 'w') as file:
+        json.dump(verdict, file, indent=2)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+import json
+import sqlite3
+import time
+import uuid
+
+from logg import logger
+
+STATISTICS_COLUMNS = ["count", "mean", "stddev", "min", "p50", "p90", "p99", "max", "sample_rate"]
+HARDWARE_COLUMNS = ["cpu", "gpu", "vram", "ram"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    started_at REAL NOT NULL,
+    finished_at REAL,
+    duration REAL,
+    mode TEXT,
+    deployments TEXT
+);
+CREATE TABLE IF NOT EXISTS pod_metrics (
+    run_id TEXT NOT NULL REFERENCES runs (run_id),
+    deployment TEXT NOT NULL,
+    pod TEXT NOT NULL,
+    node TEXT,
+    image TEXT,
+    camera_number INTEGER,
+    metric TEXT NOT NULL,
+    value REAL,
+    count INTEGER,
+    mean REAL,
+    stddev REAL,
+    min REAL,
+    p50 REAL,
+    p90 REAL,
+    p99 REAL,
+    max REAL,
+    sample_rate REAL,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS pod_metrics_deployment ON pod_metrics (deployment, metric, run_id);
+CREATE INDEX IF NOT EXISTS pod_metrics_run ON pod_metrics (run_id);
+CREATE TABLE IF NOT EXISTS node_hardware (
+    run_id TEXT NOT NULL REFERENCES runs (run_id),
+    node TEXT,
+    cpu REAL,
+    gpu REAL,
+    vram REAL,
+    ram REAL
+);
+CREATE INDEX IF NOT EXISTS node_hardware_run ON node_hardware (run_id, node);
+"""
+
+
+def new_run_id():
+    return f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+def open_result_store(path):
+    connection = sqlite3.connect(path, timeout=30)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def parse_camera_number(camera_number):
+    try:
+        return int(camera_number)
+    except (TypeError, ValueError):
+        return None
+
+
+def metric_rows(run_id, deployment_name, pod_name, node, image, summary):
+    camera_number = parse_camera_number(summary.get("Camera Number"))
+    rows = []
+    for metric_name, result in summary.items():
+        if metric_name in ("Camera Number", "Statistics"):
+            continue
+        stats = summary["Statistics"].get(metric_name, {})
+        value = result if isinstance(result, (int, float)) and not isinstance(result, bool) else None
+        detail = result if isinstance(result, str) and result and not stats else None
+        rows.append([run_id, deployment_name, pod_name, node, image, camera_number, metric_name, value]
+                    + [stats.get(column) for column in STATISTICS_COLUMNS] + [detail])
+    return rows
+
+
+def record_run(path, run_info, pod_results, deployment_results, pod_nodes=None, pod_images=None, node_averages=None):
+    pod_nodes = pod_nodes or {}
+    pod_images = pod_images or {}
+    run_id = run_info["run_id"]
+
+    rows = []
+    deployment_pods = {}
+    for pod_name, summary in pod_results.items():
+        deployment_name = pod_name.split('-')[0]
+        deployment_pods.setdefault(deployment_name, []).append(pod_name)
+        rows += metric_rows(run_id, deployment_name, pod_name, pod_nodes.get(pod_name), pod_images.get(pod_name), summary)
+
+    for deployment_name, summary in deployment_results.items():
+        pod_names = deployment_pods.get(deployment_name, [])
+        nodes = ";".join(sorted({pod_nodes[p] for p in pod_names if pod_nodes.get(p)})) or None
+        images = ";".join(sorted({pod_images[p] for p in pod_names if pod_images.get(p)})) or None
+        rows += metric_rows(run_id, deployment_name, "*", nodes, images, summary)
+
+    hardware_rows = [[run_id, node] + [averages.get(column) for column in HARDWARE_COLUMNS]
+                     for node, averages in (node_averages or {}).items()]
+
+    connection = open_result_store(path)
+    try:
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?)",
+                               [run_id, run_info["started_at"], time.time(), run_info.get("duration"),
+                                run_info.get("mode"), json.dumps(run_info.get("deployments", []))])
+            connection.executemany(f"INSERT INTO pod_metrics VALUES ({', '.join('?' * 18)})", rows)
+            connection.executemany("INSERT INTO node_hardware VALUES (?, ?, ?, ?, ?, ?)", hardware_rows)
+    finally:
+        connection.close()
+
+    logger.info(f"Recorded run {run_id} with {len(rows)} metric rows in {path}")
+    return run_id
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+
+import copy
+import json
+import math
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from calculations import CameraNumber, concat_metrics
+from deployment_processing import (create_pod_metrics, create_info_metrics, pod_deployment_name, summarize_metrics,
+                                   aggregate_deployment_metrics, deployment_nodes)
+from hw import combine_hardware_averages, follow_hw_metrics
+from hw_sampler import summarize_samples
+from k8s import follow_logs, discover_pods, resolve_node_addresses
+from logg import logger
+from telemetry import snapshot, to_prometheus, timed
+
+# Lines can arrive a little after the second they were logged in, so a bucket is only read once this has passed.
+LATE_LINE_GRACE_SECONDS = 2
+
+
+class WindowedPodMetrics:
+    # Feeds lines into one set of accumulators per step of time, so a window is the concatenation of its steps
+    # and samples expire by dropping whole steps.
+    def __init__(self, create_metrics, step):
+        self.create_metrics = create_metrics
+        self.step = step
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.current_index = None
+        self.current_metrics = None
+
+    def feed(self, line, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        index = int(timestamp // self.step)
+        with self.lock:
+            if index != self.current_index:
+                self.current_index = index
+                self.current_metrics = self.buckets.get(index)
+                if self.current_metrics is None:
+                    self.current_metrics = self.buckets[index] = self.create_metrics()
+            for metric in self.current_metrics:
+                metric.feed(line, timestamp)
+
+    def window(self, first_index, last_index):
+        with self.lock:
+            buckets = [copy.deepcopy(self.buckets[i]) for i in sorted(self.buckets) if first_index <= i <= last_index]
+        if not buckets:
+            return []
+        return concat_metrics(buckets)
+
+    def expire(self, before_index):
+        with self.lock:
+            for index in [i for i in self.buckets if i < before_index]:
+                del self.buckets[index]
+            if self.current_index is not None and self.current_index < before_index:
+                self.current_index = self.current_metrics = None
+
+
+class RollingMetrics:
+    # Takes the place of LiveMetrics for captures that never end.
+    def __init__(self, step):
+        self.step = step
+        self.lock = threading.Lock()
+        self.pods = {}
+
+    def _entry(self, pod_name):
+        with self.lock:
+            return self.pods.setdefault(pod_name, {"camera": None, "pod": None, "info": None})
+
+    def create_pod_metrics(self, pod_name):
+        deployment_name = pod_deployment_name(pod_name)
+        entry = self._entry(pod_name)
+        # A resumed capture keeps feeding the pod's steps. The camera count is logged once at startup, so it is
+        # kept for the whole run instead of per window.
+        if entry["pod"] is None:
+            entry["camera"] = CameraNumber(deployment_name, pod_name)
+            entry["pod"] = WindowedPodMetrics(
+                lambda: [m for m in create_pod_metrics(deployment_name, pod_name, continuation=True)
+                         if not isinstance(m, CameraNumber)], self.step)
+        return [entry["camera"], entry["pod"]]
+
+    def create_info_metrics(self, pod_name):
+        deployment_name = pod_deployment_name(pod_name)
+        entry = self._entry(pod_name)
+        if entry["info"] is None:
+            entry["info"] = WindowedPodMetrics(lambda: create_info_metrics(deployment_name, f"info-{pod_name}"),
+                                               self.step)
+        return [entry["info"]]
+
+    def window_metrics(self, first_index, last_index):
+        with self.lock:
+            pods = dict(self.pods)
+        pod_metrics = {}
+        for pod_name, entry in sorted(pods.items()):
+            if entry["pod"] is None:
+                continue
+            metrics = entry["pod"].window(first_index, last_index)
+            if not metrics:
+                continue
+            if entry["info"] is not None:
+                metrics += entry["info"].window(first_index, last_index)
+            pod_metrics[pod_name] = [copy.copy(entry["camera"])] + metrics
+        return pod_metrics
+
+    def expire(self, before_index):
+        with self.lock:
+            windowed = [m for entry in self.pods.values() for m in (entry["pod"], entry["info"]) if m is not None]
+        for metrics in windowed:
+            metrics.expire(before_index)
+
+
+class RollingHardware:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def add_sample(self, node, sample):
+        with self.lock:
+            self.samples.setdefault(node, deque()).append(sample)
+
+    def window_averages(self, start, end):
+        with self.lock:
+            samples = {node: [s for s in node_samples if start <= s["timestamp"] < end]
+                       for node, node_samples in self.samples.items()}
+        return {node: summarize_samples(node_samples) for node, node_samples in samples.items() if node_samples}
+
+    def expire(self, before):
+        with self.lock:
+            for node_samples in self.samples.values():
+                while node_samples and node_samples[0]["timestamp"] < before:
+                    node_samples.popleft()
+
+
+class LatestResults:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.results = None
+
+    def set(self, results):
+        with self.lock:
+            self.results = results
+
+    def get(self):
+        with self.lock:
+            return self.results
+
+
+class ResultsHandler(BaseHTTPRequestHandler):
+    latest_results = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body, content_type, status=200):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path in ("/", "/results"):
+            results = self.latest_results.get()
+            if results is None:
+                return self.send_body(json.dumps({"error": "no window has completed yet"}), "application/json", 503)
+            return self.send_body(json.dumps(results, indent=2), "application/json")
+        if path == "/metrics":
+            return self.send_body(to_prometheus(snapshot()), "text/plain; version=0.0.4")
+        if path == "/healthz":
+            # Healthy until the first window completes, then only while the latest window has lines from some pod.
+            results = self.latest_results.get()
+            if results is not None and not results["pods"]:
+                return self.send_body("no pod logged a line in the last window\n", "text/plain", 503)
+            return self.send_body("ok\n", "text/plain")
+        self.send_body(json.dumps({"error": f"unknown path {path}"}), "application/json", 404)
+
+
+def start_results_server(latest_results, host, port):
+    class Handler(ResultsHandler):
+        pass
+
+    Handler.latest_results = latest_results
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Serving the latest window results on http://{host}:{server.server_address[1]}/results")
+    return server
+
+
+def compute_window(rolling_metrics, rolling_hardware, pod_nodes, deployments, window_start, window_end):
+    step = rolling_metrics.step
+    pod_metrics = rolling_metrics.window_metrics(int(window_start // step), int(window_end // step) - 1)
+    pod_results = {pod_name: summarize_metrics(pod_name, metrics) for pod_name, metrics in pod_metrics.items()}
+    deployment_metrics = aggregate_deployment_metrics(pod_metrics)
+    deployment_results = {deployment_name: summarize_metrics(deployment_name, metrics)
+                          for deployment_name, metrics in deployment_metrics.items()}
+
+    node_averages = rolling_hardware.window_averages(window_start, window_end)
+    nodes_by_deployment = deployment_nodes(pod_nodes, deployments)
+    deployment_hardware = {deployment_name: combine_hardware_averages(node_averages[n] for n in nodes if n in node_averages)
+                           for deployment_name, nodes in nodes_by_deployment.items()
+                           if any(n in node_averages for n in nodes)}
+
+    return {
+        "window_start": window_start,
+        "window_end": window_end,
+        "window_seconds": window_end - window_start,
+        "computed_at": time.time(),
+        "pods": pod_results,
+        "deployments": deployment_results,
+        "hardware": {"nodes": node_averages, "deployments": deployment_hardware},
+    }, node_averages
+
+
+def run_windows(rolling_metrics, rolling_hardware, latest_results, pod_nodes, deployments, window_seconds,
+                on_window=None, stop_event=None):
+    # Every step a window ending on the step boundary is computed; with window_seconds equal to the step the
+    # windows tumble, with a multiple of it they roll.
+    step = rolling_metrics.step
+    stop_event = stop_event or threading.Event()
+    # The first window is the first one that lies entirely after the captures started.
+    next_end = math.ceil((time.time() + window_seconds) / step) * step
+    while not stop_event.wait(max(next_end + LATE_LINE_GRACE_SECONDS - time.time(), 0)):
+        window_end = next_end
+        window_start = window_end - window_seconds
+        with timed("window"):
+            results, node_averages = compute_window(rolling_metrics, rolling_hardware, pod_nodes, deployments,
+                                                    window_start, window_end)
+        latest_results.set(results)
+        logger.info(f"Window {time.strftime('%H:%M:%S', time.localtime(window_start))} - "
+                    f"{time.strftime('%H:%M:%S', time.localtime(window_end))}: {len(results['pods'])} pods")
+        if on_window is not None:
+            on_window(results, node_averages)
+
+        # Only the steps the next window still covers are kept.
+        rolling_metrics.expire(int((window_start + step) // step))
+        rolling_hardware.expire(window_start + step)
+        next_end += step
+        if next_end + LATE_LINE_GRACE_SECONDS < time.time():
+            skipped = math.floor((time.time() - LATE_LINE_GRACE_SECONDS - next_end) / step) + 1
+            logger.warning(f"Window computation fell behind, skipping {skipped} windows")
+            next_end += skipped * step
+
+
+def run_daemon(deployments, log_dir, window_seconds, step_seconds, host, port, remote_user, remote_ip, ssh_password,
+               hw_node_discovery=True, capture_backend="api"):
+    # Streams, exec polls and hardware sampling stay open for the life of the process and no raw logs pile
+    # up on disk; the pods are listed again every step to follow the ones that replace others.
+    if window_seconds < step_seconds or window_seconds % step_seconds:
+        raise ValueError(f"The window ({window_seconds}s) must be a multiple of the step ({step_seconds}s)")
+
+    rolling_metrics = RollingMetrics(step_seconds)
+    rolling_hardware = RollingHardware()
+    latest_results = LatestResults()
+    start_results_server(latest_results, host, port)
+
+    pod_nodes = discover_pods(deployments)[0] if hw_node_discovery else {}
+    node_addresses = resolve_node_addresses(set(pod_nodes.values()))
+    if node_addresses:
+        logger.info(f"Collecting hardware metrics from nodes: {node_addresses}")
+    else:
+        pod_nodes = {}
+        node_addresses = {None: remote_ip}
+    for node, address in node_addresses.items():
+        threading.Thread(target=follow_hw_metrics, daemon=True,
+                         args=(remote_user, address, ssh_password, node, rolling_hardware.add_sample)).start()
+
+    stop_event = threading.Event()
+    for deployment in deployments:
+        threading.Thread(target=follow_logs, daemon=True,
+                         args=(deployment, log_dir, rolling_metrics, step_seconds, stop_event, step_seconds,
+                               capture_backend)).start()
+
+    logger.info(f"Computing {window_seconds}s windows every {step_seconds}s.")
+    try:
+        run_windows(rolling_metrics, rolling_hardware, latest_results, pod_nodes, deployments, window_seconds,
+                    stop_event=stop_event)
+    finally:
+        stop_event.set()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+# Measures how fast the benchmarker itself captures and processes logs, against a local
+# fake Kubernetes API that serves synthetic logs, e.g.:
+#   python3 selfbench.py --pods-per-namespace 5 --rate 5000 --duration 30
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from logg import logger
+from fake_k8s import FakeKubernetesApi, expected_lines
+from deployment_processing import deployments_mapping, LiveMetrics, process_and_write_results, available_cpus
+from telemetry import snapshot, summary_total, counter_total, set_profiling, write_profile
+
+
+def reset_peak_rss():
+    # Writing 5 to clear_refs resets VmHWM on Linux, so every stage reports its own peak.
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def cpu_seconds(who):
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(function):
+    peak_is_per_stage = reset_peak_rss()
+    started_at = time.perf_counter()
+    cpu_started = cpu_seconds(resource.RUSAGE_SELF)
+    children_cpu_started = cpu_seconds(resource.RUSAGE_CHILDREN)
+
+    result = function()
+
+    wall = time.perf_counter() - started_at
+    stats = {
+        "wall_seconds": wall,
+        "cpu_seconds": cpu_seconds(resource.RUSAGE_SELF) - cpu_started,
+        "worker_cpu_seconds": cpu_seconds(resource.RUSAGE_CHILDREN) - children_cpu_started,
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_rss_is_per_stage": peak_is_per_stage,
+        "worker_peak_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+    stats["cpu_utilisation"] = (stats["cpu_seconds"] + stats["worker_cpu_seconds"]) / wall if wall else None
+    return result, stats
+
+
+def serve_fake_api(connection, namespaces, pods_per_namespace, rate, noise, info_rate, started_at):
+    fake_api = FakeKubernetesApi(namespaces, pods_per_namespace, rate, noise, info_rate, started_at=started_at).start()
+    connection.send(fake_api.url)
+    connection.recv()
+    fake_api.stop()
+    connection.send(fake_api.stats())
+
+
+def start_fake_api(namespaces, pods_per_namespace, rate, noise, info_rate, started_at):
+    # The fake API runs in its own process so its CPU time and memory stay out of the measurements.
+    parent_connection, child_connection = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=serve_fake_api, daemon=True,
+                                      args=(child_connection, namespaces, pods_per_namespace, rate, noise, info_rate,
+                                            started_at))
+    process.start()
+    url = parent_connection.recv()
+
+    def stop():
+        parent_connection.send("stop")
+        stats = parent_connection.recv() if parent_connection.poll(10) else {}
+        process.join(10)
+        return stats
+
+    return url, stop
+
+
+def run_capture(namespaces, duration, log_dir, live_metrics, write_raw_logs, log_compression):
+    # Imported here so the client picks up K8S_API_HOST from the harness.
+    from k8s import capture_logs
+
+    with ThreadPoolExecutor(max_workers=len(namespaces)) as executor:
+        futures = {namespace: executor.submit(capture_logs, namespace, duration, log_dir, None, live_metrics,
+                                              write_raw_logs, log_compression)
+                   for namespace in namespaces}
+        return {namespace: future.result() for namespace, future in futures.items()}
+
+
+def capture_report(started_at, rate, capture_windows, duration, stats):
+    captured = expected = byte_count = 0
+    for windows in capture_windows.values():
+        for window in windows.values():
+            for line_count, pod_bytes in window["pods"].values():
+                captured += line_count
+                byte_count += pod_bytes
+                # The capture window opens just after started_at, so this slightly overestimates what was due.
+                expected += expected_lines(started_at, rate, window["started_at"], window["started_at"] + duration)
+
+    return {
+        **stats,
+        "lines": captured,
+        "bytes": byte_count,
+        "expected_lines": expected,
+        "dropped_lines": max(expected - captured, 0),
+        "drop_rate": max(expected - captured, 0) / expected if expected else None,
+        "lines_per_second": captured / stats["wall_seconds"] if stats["wall_seconds"] else None,
+    }
+
+
+def configure_logging(level):
+    logger.setLevel(getattr(logging, level.upper()))
+    logger.handlers.clear()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    logger.addHandler(handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark log capture and processing against a fake Kubernetes API.")
+    parser.add_argument("--namespaces", default=",".join(deployments_mapping),
+                        help="comma separated deployment namespaces to simulate")
+    parser.add_argument("--pods-per-namespace", type=int, default=1)
+    parser.add_argument("--rate", type=float, default=1000, help="log lines per second per pod")
+    parser.add_argument("--info-rate", type=float, default=10, help="IDS info log lines per second")
+    parser.add_argument("--noise", type=float, default=0.5, help="fraction of lines no metric parses")
+    parser.add_argument("--duration", type=int, default=20)
+    parser.add_argument("--offline", action="store_true", help="parse the raw log files instead of streaming metrics")
+    parser.add_argument("--no-raw-logs", action="store_true")
+    parser.add_argument("--compression", choices=["gzip", "zstd"])
+    parser.add_argument("--processing-workers", type=int, default=available_cpus())
+    parser.add_argument("--output", help="also write the report as JSON to this file")
+    parser.add_argument("--profile", help="write a cProfile of capture and processing to this file")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    configure_logging(args.log_level)
+    set_profiling(bool(args.profile))
+    namespaces = [n for n in args.namespaces.split(",") if n]
+    write_raw_logs = not args.no_raw_logs or args.offline
+    log_dir = tempfile.mkdtemp(prefix="selfbench-")
+
+    started_at = time.time()
+    api_url, stop_fake_api = start_fake_api(namespaces, args.pods_per_namespace, args.rate, args.noise, args.info_rate,
+                                            started_at)
+    os.environ["K8S_API_HOST"] = api_url
+    try:
+        live_metrics = None if args.offline else LiveMetrics()
+        capture_windows, capture_stats = measure(lambda: run_capture(namespaces, args.duration, log_dir, live_metrics,
+                                                                     write_raw_logs, args.compression))
+        capture = capture_report(started_at, args.rate, capture_windows, args.duration, capture_stats)
+
+        _, processing = measure(lambda: process_and_write_results(
+            log_dir, namespaces, os.path.join(log_dir, "single_results.csv"), os.path.join(log_dir, "combo_results.csv"),
+            live_metrics, os.path.join(log_dir, "metric_statistics.csv"), args.processing_workers))
+        processing["lines_per_second"] = capture["lines"] / processing["wall_seconds"] if processing["wall_seconds"] else None
+
+        report = {
+            "namespaces": namespaces,
+            "pods": len(namespaces) * args.pods_per_namespace,
+            "lines_per_second_per_pod": args.rate,
+            "offered_lines_per_second": len(namespaces) * args.pods_per_namespace * args.rate,
+            "duration": args.duration,
+            "mode": "offline" if args.offline else "streaming",
+            "raw_logs": write_raw_logs,
+            "compression": args.compression,
+            "capture": capture,
+            "processing": processing,
+        }
+        telemetry = snapshot()
+        report["telemetry"] = {
+            "capture_lag_seconds": summary_total(telemetry, "capture_lag_seconds"),
+            "stream_reconnects": counter_total(telemetry, "stream_reconnects_total"),
+            "stream_failures": counter_total(telemetry, "stream_failures_total"),
+            "stages": {stage: summary_total({"summaries": [s for s in telemetry["summaries"]
+                                                           if s["labels"].get("stage") == stage]}, "stage_seconds")
+                       for stage in sorted({s["labels"]["stage"] for s in telemetry["summaries"]
+                                            if s["name"] == "stage_seconds"})},
+        }
+    finally:
+        fake_api_stats = stop_fake_api()
+        shutil.rmtree(log_dir, ignore_errors=True)
+
+    report["fake_api"] = fake_api_stats
+    if args.profile:
+        write_profile(args.profile)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+import csv
+import time
+
+from logg import logger
+from k8s import capture_logs
+from k8s_client import get_kubernetes_api_client
+from deployment_processing import LiveMetrics, aggregate_deployment_metrics, write_csv_header
+from readiness import wait_for_steady_state
+
+# Without SWEEP_MAX_QUEUE_GROWTH, the queue may grow by at most this fraction of the queue size limit from the
+# first to the last third of a probe; a queue that keeps growing would exceed the limit if the probe ran longer.
+QUEUE_GROWTH_FRACTION = 0.5
+
+capacity_header = ["Timestamp", "Namespace", "Deployment", "Parameter", "Value", "Passed", "Rolled Out",
+                   "Server Load (%)", "FPS", "Queue Size P99", "Queue Size Growth"]
+
+
+def get_parameter(deployment, parameter, container_name=None):
+    # Replicas as a number; an env var as {container name: its V1EnvVar, or None where the container does not set it}.
+    if parameter == "replicas":
+        return deployment.spec.replicas
+    return {c.name: next((env for env in c.env or [] if env.name == parameter), None)
+            for c in deployment.spec.template.spec.containers if container_name is None or c.name == container_name}
+
+
+def referenced_containers(original):
+    # A valueFrom entry cannot take a literal value next to it, and a restore could not bring the reference back.
+    return sorted(c for c, env in original.items() if env is not None and env.value_from is not None)
+
+
+def env_patch(deployment, container_name, env_entry):
+    # Strategic merge patches merge env entries by name, so other variables are left alone.
+    containers = [c.name for c in deployment.spec.template.spec.containers if container_name is None or c.name == container_name]
+    return {"spec": {"template": {"spec": {"containers": [{"name": c, "env": [env_entry]} for c in containers]}}}}
+
+
+def restore_parameter(apps_v1_api, deployment, parameter, original, container_name=None):
+    if parameter == "replicas":
+        if original is not None:
+            set_parameter(apps_v1_api, deployment, parameter, original)
+        return
+    # Containers that did not set the variable before the sweep get it removed, the others their own value back.
+    containers = [{"name": c, "env": [{"name": parameter, "$patch": "delete"} if env is None
+                                      else {"name": parameter, "value": env.value or ""}]}
+                  for c, env in original.items()]
+    body = {"spec": {"template": {"spec": {"containers": containers}}}}
+    apps_v1_api.patch_namespaced_deployment(deployment.metadata.name, deployment.metadata.namespace, body)
+
+
+def set_parameter(apps_v1_api, deployment, parameter, value, container_name=None):
+    name = deployment.metadata.name
+    namespace = deployment.metadata.namespace
+    if parameter == "replicas":
+        apps_v1_api.patch_namespaced_deployment_scale(name, namespace, {"spec": {"replicas": int(value)}})
+        return
+
+    apps_v1_api.patch_namespaced_deployment(name, namespace,
+                                            env_patch(deployment, container_name, {"name": parameter, "value": str(value)}))
+
+
+def find_stats(metrics, metric_name):
+    for metric in metrics:
+        if metric.name == metric_name:
+            return metric.stats()
+    return None
+
+
+def interval_mean(intervals):
+    return sum(mean * count for _, mean, count in intervals) / sum(count for _, _, count in intervals)
+
+
+def queue_growth(metrics):
+    for metric in metrics:
+        if metric.name == "calculate_queue_size":
+            intervals = metric.series.interval_means()
+            if len(intervals) < 2:
+                return None
+            third = max(len(intervals) // 3, 1)
+            return interval_mean(intervals[-third:]) - interval_mean(intervals[:third])
+    return None
+
+
+def evaluate_probe(metrics, max_queue_size=None, min_fps=None, max_load=None, max_queue_growth=None):
+    load = find_stats(metrics, "calculate_average_load")
+    fps = find_stats(metrics, "calculate_fps")
+    queue = find_stats(metrics, "calculate_queue_size")
+    growth = queue_growth(metrics)
+
+    checks = []
+    if max_queue_size is not None and queue and queue["count"]:
+        if max_queue_growth is None:
+            max_queue_growth = max_queue_size * QUEUE_GROWTH_FRACTION
+        checks.append(queue["p99"] <= max_queue_size and (growth is None or growth <= max_queue_growth))
+    if min_fps is not None and fps and fps["count"]:
+        checks.append(fps["mean"] >= min_fps)
+    if max_load is not None and load and load["count"]:
+        checks.append(load["mean"] <= max_load)
+
+    summary = {
+        "load": load["mean"] if load else None,
+        "fps": fps["mean"] if fps else None,
+        "queue_p99": queue["p99"] if queue else None,
+        "queue_growth": growth,
+    }
+    return bool(checks) and all(checks), summary
+
+
+class CapacitySweep:
+    def __init__(self, namespace, deployment_name, parameter, duration, log_dir, results_file, rollout_timeout,
+                 container_name=None, max_queue_size=None, min_fps=None, max_load=None, warmup_seconds=0, marker=None,
+                 capture_backend="api", max_queue_growth=None):
+        self.namespace = namespace
+        self.deployment_name = deployment_name
+        self.parameter = parameter
+        self.duration = duration
+        self.log_dir = log_dir
+        self.results_file = results_file
+        self.rollout_timeout = rollout_timeout
+        self.container_name = container_name
+        self.max_queue_size = max_queue_size
+        self.min_fps = min_fps
+        self.max_load = max_load
+        self.warmup_seconds = warmup_seconds
+        self.marker = marker
+        self.capture_backend = capture_backend
+        self.max_queue_growth = max_queue_growth
+        self.core_v1_api, self.apps_v1_api = get_kubernetes_api_client()
+        self.curve = {}
+
+    def read_deployment(self):
+        return self.apps_v1_api.read_namespaced_deployment(self.deployment_name, self.namespace)
+
+    def probe(self, value):
+        if value in self.curve:
+            return self.curve[value]["passed"]
+
+        logger.info(f"Sweep: setting {self.parameter}={value} on {self.namespace}/{self.deployment_name}")
+        set_parameter(self.apps_v1_api, self.read_deployment(), self.parameter, value, self.container_name)
+        waited = wait_for_steady_state([self.namespace], self.rollout_timeout, self.warmup_seconds, self.marker)
+        rolled_out = waited["deployments"].get(f"{self.namespace}/{self.deployment_name}", {}).get("ready", False)
+
+        passed, summary = False, {}
+        if rolled_out:
+            live_metrics = LiveMetrics()
+            capture_logs(self.namespace, self.duration, self.log_dir, live_metrics=live_metrics, write_raw_logs=False,
+                         capture_backend=self.capture_backend)
+            deployment_metrics = aggregate_deployment_metrics(live_metrics.pod_metrics([self.namespace]))
+            metrics = deployment_metrics.get(self.namespace, [])
+            passed, summary = evaluate_probe(metrics, self.max_queue_size, self.min_fps, self.max_load,
+                                             self.max_queue_growth)
+
+        logger.info(f"Sweep: {self.parameter}={value} {'passed' if passed else 'failed'} {summary}")
+        self.curve[value] = {"passed": passed, "rolled_out": rolled_out, **summary}
+        self.write_probe(value)
+        return passed
+
+    def write_probe(self, value):
+        result = self.curve[value]
+        with open(self.results_file, 'a', newline='') as csvfile:
+            csvwriter = csv.writer(csvfile)
+            write_csv_header(csvwriter, self.results_file, capacity_header)
+            row = [time.strftime('%Y-%m-%d %H:%M:%S'), self.namespace, self.deployment_name, self.parameter, value,
+                   result["passed"], result["rolled_out"]]
+            row += ["" if result.get(k) is None else result[k] for k in ["load", "fps", "queue_p99", "queue_growth"]]
+            csvwriter.writerow(row)
+
+    def binary_search(self, low, high):
+        best = None
+        while low <= high:
+            value = (low + high) // 2
+            if self.probe(value):
+                best = value
+                low = value + 1
+            else:
+                high = value - 1
+        return best
+
+    def linear_search(self, low, high, step):
+        best = None
+        for value in range(low, high + 1, step):
+            if not self.probe(value):
+                break
+            best = value
+        return best
+
+    def run(self, low, high, strategy="binary", step=1):
+        original = get_parameter(self.read_deployment(), self.parameter, self.container_name)
+        if self.parameter != "replicas":
+            referenced = referenced_containers(original)
+            if referenced:
+                raise ValueError(f"{self.parameter} is set with valueFrom in containers {referenced} of "
+                                 f"{self.namespace}/{self.deployment_name} and cannot be swept")
+        try:
+            if strategy == "linear":
+                best = self.linear_search(low, high, step)
+            else:
+                best = self.binary_search(low, high)
+        finally:
+            logger.info(f"Sweep: restoring the original {self.parameter} of {self.namespace}/{self.deployment_name}")
+            restore_parameter(self.apps_v1_api, self.read_deployment(), self.parameter, original, self.container_name)
+
+        logger.info(f"Sweep: highest passing {self.parameter} for {self.namespace}/{self.deployment_name} is {best}")
+        return best, self.curve
+
+
+def run_capacity_sweep(namespace, parameter, low, high, duration, log_dir, results_file, rollout_timeout,
+                       deployment_name=None, container_name=None, max_queue_size=None, min_fps=None, max_load=None,
+                       strategy="binary", step=1, warmup_seconds=0, marker=None, capture_backend="api",
+                       max_queue_growth=None):
+    if max_queue_size is None and min_fps is None and max_load is None:
+        raise ValueError("A capacity sweep needs at least one of SWEEP_MAX_QUEUE_SIZE, SWEEP_MIN_FPS or SWEEP_MAX_LOAD")
+
+    if deployment_name is None:
+        _, apps_v1_api = get_kubernetes_api_client()
+        deployments = apps_v1_api.list_namespaced_deployment(namespace)
+        if not deployments.items:
+            logger.error(f"No deployments found in namespace {namespace} to sweep")
+            return None, {}
+        deployment_name = deployments.items[0].metadata.name
+
+    sweep = CapacitySweep(namespace, deployment_name, parameter, duration, log_dir, results_file, rollout_timeout,
+                          container_name, max_queue_size, min_fps, max_load, warmup_seconds, marker, capture_backend,
+                          max_queue_growth)
+    return sweep.run(low, high, strategy, step)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+import time
+
+SYNTHETIC_CAMERAS = 4
+NOISE_LINE = "Processed frame batch, waiting for the next one"
+INFO_LOG_CAMERAS = 8
+
+CAMERA_LINE_FORMATS = {
+    'ptd': "Number of cameras: {}",
+    'rmd': "Number of cameras: {}",
+    'aod': "Number of cameras: {}",
+    'fds': "Total number of cameras:{}",
+    'sfds': "Total number of cameras:{}",
+    'snfds': "Total number of cameras:{}",
+    'tds': "Total number of cameras:{}",
+    'ids': "Batch size: {}",
+    'tfa': "Batch size: {}",
+}
+
+
+def format_log_timestamp(timestamp):
+    seconds = int(timestamp)
+    nanoseconds = int(round((timestamp - seconds) * 1e9))
+    if nanoseconds >= 1000000000:
+        seconds, nanoseconds = seconds + 1, nanoseconds - 1000000000
+    return f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds))}.{nanoseconds:09d}Z"
+
+
+def server_load_line(index):
+    return f"Server load of inference {40 + index % 50}%"
+
+
+def metric_line(deployment_name, index):
+    if deployment_name in ('ptd', 'rmd', 'aod', 'ids'):
+        return server_load_line(index)
+    if deployment_name == 'tfa':
+        return server_load_line(index // 2) if index % 2 == 0 else f"Num samples: {50 + index % 200}"
+    if deployment_name in ('fds', 'sfds', 'snfds', 'tds'):
+        return f"Inference queue size: {index % 8}"
+    if deployment_name == 'frs':
+        return f"FPS:{20 + (index % 100) / 10:.2f}"
+    return NOISE_LINE
+
+
+def pod_log_line(deployment_name, index, noise=0.5):
+    # The line at a given index is always the same, so a stream can be replayed from any point.
+    if index == 0 and deployment_name in CAMERA_LINE_FORMATS:
+        return CAMERA_LINE_FORMATS[deployment_name].format(SYNTHETIC_CAMERAS)
+    if index % 100 < noise * 100:
+        return NOISE_LINE
+    return metric_line(deployment_name, index)
+
+
+def motion_alert_line(index, timestamp):
+    # Fixed width, so a byte offset in the info log maps straight to a line index.
+    return (f"[{format_log_timestamp(timestamp)}] Number of motion alerts from camera: "
+            f"[camera-{index % INFO_LOG_CAMERAS:02d}]{index * 7 % 50:04d}\n")
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+import cProfile
+import functools
+import json
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+from logg import logger
+
+_lock = threading.Lock()
+_counters = {}
+_summaries = {}
+_profiles = []
+_profiling = False
+
+METRIC_PREFIX = "bench_"
+TELEMETRY_FORMATS = ("json", "prometheus")
+
+
+def label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def increment(name, value=1, **labels):
+    key = (name, label_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe_many(name, count, total, maximum, **labels):
+    if not count:
+        return
+    key = (name, label_key(labels))
+    with _lock:
+        summary = _summaries.setdefault(key, [0, 0.0, None])
+        summary[0] += count
+        summary[1] += total
+        summary[2] = maximum if summary[2] is None else max(summary[2], maximum)
+
+
+def observe(name, value, **labels):
+    observe_many(name, 1, value, value, **labels)
+
+
+@contextmanager
+def timed(stage, **labels):
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("stage_seconds", time.perf_counter() - started_at, stage=stage, **labels)
+
+
+class StreamStats:
+    # Kept per stream and published once, so the per-line path never takes the registry lock.
+    def __init__(self):
+        self.lines = 0
+        self.bytes = 0
+        self.lag_count = 0
+        self.lag_sum = 0.0
+        self.lag_max = None
+
+    def record(self, byte_count, lag=None):
+        self.lines += 1
+        self.bytes += byte_count
+        if lag is not None:
+            self.lag_count += 1
+            self.lag_sum += lag
+            self.lag_max = lag if self.lag_max is None or lag > self.lag_max else self.lag_max
+
+    def publish(self, **labels):
+        increment("stream_lines_total", self.lines, **labels)
+        increment("stream_bytes_total", self.bytes, **labels)
+        observe_many("capture_lag_seconds", self.lag_count, self.lag_sum, self.lag_max, **labels)
+
+
+def snapshot():
+    with _lock:
+        counters = [{"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(_counters.items())]
+        summaries = [{"name": name, "labels": dict(labels), "count": count, "sum": total, "max": maximum,
+                      "mean": total / count if count else None}
+                     for (name, labels), (count, total, maximum) in sorted(_summaries.items())]
+    return {"timestamp": time.time(), "counters": counters, "summaries": summaries}
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{escape_label_value(v)}"' for k, v in sorted(labels.items())) + "}"
+
+
+def to_prometheus(data=None):
+    data = data or snapshot()
+    lines = []
+    for name in sorted({c["name"] for c in data["counters"]}):
+        lines.append(f"# TYPE {METRIC_PREFIX}{name} counter")
+        lines += [f"{METRIC_PREFIX}{name}{format_labels(c['labels'])} {c['value']}"
+                  for c in data["counters"] if c["name"] == name]
+    for name in sorted({s["name"] for s in data["summaries"]}):
+        lines.append(f"# TYPE {METRIC_PREFIX}{name} summary")
+        for s in (s for s in data["summaries"] if s["name"] == name):
+            labels = format_labels(s["labels"])
+            lines.append(f"{METRIC_PREFIX}{name}_count{labels} {s['count']}")
+            lines.append(f"{METRIC_PREFIX}{name}_sum{labels} {s['sum']}")
+        lines.append(f"# TYPE {METRIC_PREFIX}{name}_max gauge")
+        lines += [f"{METRIC_PREFIX}{name}_max{format_labels(s['labels'])} {s['max']}"
+                  for s in data["summaries"] if s["name"] == name]
+    return "\n".join(lines) + "\n"
+
+
+def validate_telemetry_format(output_format):
+    if output_format not in TELEMETRY_FORMATS:
+        raise ValueError(f"Invalid telemetry format: {output_format}")
+
+
+def write_telemetry(path, output_format="json"):
+    data = snapshot()
+    with open(path, 'w') as file:
+        if output_format == "prometheus":
+            file.write(to_prometheus(data))
+        else:
+            json.dump(data, file, indent=2)
+    return data
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _summaries.clear()
+
+
+def set_profiling(enabled):
+    global _profiling
+    _profiling = enabled
+
+
+def profiled(function):
+    # cProfile only sees the thread it was enabled in, so worker threads are profiled separately and merged.
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _profiling:
+            return function(*args, **kwargs)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profile.disable()
+            with _lock:
+                _profiles.append(profile)
+    return wrapper
+
+
+def write_profile(path):
+    with _lock:
+        profiles = list(_profiles)
+    if not profiles:
+        return False
+    stats = pstats.Stats(profiles[0])
+    for profile in profiles[1:]:
+        stats.add(profile)
+    stats.dump_stats(path)
+    return True
+
+
+def summary_total(data, name):
+    summaries = [s for s in data["summaries"] if s["name"] == name]
+    if not summaries:
+        return None
+    count = sum(s["count"] for s in summaries)
+    return {"count": count, "mean": sum(s["sum"] for s in summaries) / count if count else None,
+            "max": max(s["max"] for s in summaries)}
+
+
+def counter_total(data, name):
+    return sum(c["value"] for c in data["counters"] if c["name"] == name)
+
+
+def check_capture_health(data, lag_warning_seconds):
+    # A benchmarker that falls behind the logs it reads measures itself rather than the workload.
+    healthy = True
+    lag = summary_total(data, "capture_lag_seconds")
+    if lag is not None:
+        logger.info(f"Capture lag over {lag['count']} lines: mean {round(lag['mean'], 3)}s, max {round(lag['max'], 3)}s")
+        if lag["max"] > lag_warning_seconds:
+            logger.warning(f"Capture lag reached {round(lag['max'], 3)}s (limit {lag_warning_seconds}s), "
+                           f"the benchmarker could not keep up and the workload metrics may be invalid")
+            healthy = False
+    failures = counter_total(data, "stream_failures_total")
+    if failures:
+        logger.warning(f"{failures} log streams failed during capture, their pods are missing lines")
+        healthy = False
+    reconnects = counter_total(data, "stream_reconnects_total")
+    if reconnects:
+        logger.info(f"Log streams were reconnected {reconnects} times during capture")
+    return healthy
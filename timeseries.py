@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+
+import math
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import repeat
+from operator import mul, sub
+
+PERCENTILES = (50, 90, 99)
+# Percentiles come from logarithmic bins: each estimate is within this fraction of the true value at its rank,
+# and memory grows with the log of the value range rather than with the number of samples.
+RELATIVE_ACCURACY = float(os.getenv('QUANTILE_RELATIVE_ACCURACY', 0.01))
+# Values closer to zero than this are counted as zero.
+MIN_INDEXABLE_VALUE = 1e-9
+# Per-interval sums are kept at this resolution for the windowed analysis and queue growth.
+BUCKET_SECONDS = float(os.getenv('CORRELATION_WINDOW_SECONDS', 10))
+# Accepted samples are buffered and folded in at this batch size.
+PENDING_SAMPLES = 4096
+
+
+class QuantileSketch:
+    # DDSketch-style: bin k holds the values in (gamma^(k-1), gamma^k], so merging two sketches adds their bin
+    # counts and gives exactly the sketch of all their samples.
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def key(self, value):
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def bin_value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def add(self, value, count=1):
+        if value > MIN_INDEXABLE_VALUE:
+            key = self.key(value)
+            self.positive[key] = self.positive.get(key, 0) + count
+        elif value < -MIN_INDEXABLE_VALUE:
+            key = self.key(-value)
+            self.negative[key] = self.negative.get(key, 0) + count
+        else:
+            self.zero_count += count
+        self.count += count
+
+    def add_sorted(self, values):
+        # Each bin is one slice of the sorted values, so only the bins present cost a logarithm.
+        low = bisect_left(values, -MIN_INDEXABLE_VALUE)
+        high = bisect_right(values, MIN_INDEXABLE_VALUE, low)
+        self.zero_count += high - low
+        self.count += len(values)
+        start = high
+        while start < len(values):
+            key = self.key(values[start])
+            end = bisect_right(values, self.gamma ** key, start)
+            self.positive[key] = self.positive.get(key, 0) + end - start
+            start = max(end, start + 1)
+        negatives = [-value for value in reversed(values[:low])]
+        start = 0
+        while start < len(negatives):
+            key = self.key(negatives[start])
+            end = bisect_right(negatives, self.gamma ** key, start)
+            self.negative[key] = self.negative.get(key, 0) + end - start
+            start = max(end, start + 1)
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError(f"Cannot merge sketches with relative accuracy {self.relative_accuracy} and "
+                             f"{other.relative_accuracy}")
+        for key, count in other.positive.items():
+            self.positive[key] = self.positive.get(key, 0) + count
+        for key, count in other.negative.items():
+            self.negative[key] = self.negative.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def values_at_ranks(self, ranks):
+        # ranks are 0-based and sorted; bins are walked once from the most negative value up.
+        bins = [(-self.bin_value(key), self.negative[key]) for key in sorted(self.negative, reverse=True)]
+        bins.append((0.0, self.zero_count))
+        bins += [(self.bin_value(key), self.positive[key]) for key in sorted(self.positive)]
+
+        values = []
+        seen = 0
+        bins = iter(bins)
+        value, count = next(bins)
+        for rank in ranks:
+            while seen + count <= rank:
+                seen += count
+                value, count = next(bins, (value, math.inf))
+            values.append(value)
+        return values
+
+    def quantiles(self, qs):
+        if not self.count:
+            return [None for _ in qs]
+        positions = [(self.count - 1) * q for q in qs]
+        ranks = sorted({r for p in positions for r in (math.floor(p), math.ceil(p))})
+        values = dict(zip(ranks, self.values_at_ranks(ranks)))
+        results = []
+        for position in positions:
+            lower, upper = values[math.floor(position)], values[math.ceil(position)]
+            results.append(lower + (upper - lower) * (position - math.floor(position)))
+        return results
+
+
+class TimeBuckets:
+    # Sums and counts per BUCKET_SECONDS interval, in arrays indexed from the first interval seen.
+    def __init__(self, bucket_seconds=BUCKET_SECONDS):
+        self.bucket_seconds = bucket_seconds
+        self.first_index = None
+        self.sums = array('d')
+        self.counts = array('d')
+
+    def add(self, timestamp, value, count=1):
+        index = math.floor(timestamp / self.bucket_seconds)
+        if self.first_index is None:
+            self.first_index = index
+        elif index < self.first_index:
+            padding = self.first_index - index
+            self.sums = array('d', bytes(8 * padding)) + self.sums
+            self.counts = array('d', bytes(8 * padding)) + self.counts
+            self.first_index = index
+        position = index - self.first_index
+        if position >= len(self.sums):
+            padding = position + 1 - len(self.sums)
+            self.sums.extend(array('d', bytes(8 * padding)))
+            self.counts.extend(array('d', bytes(8 * padding)))
+        self.sums[position] += value
+        self.counts[position] += count
+
+    def merge(self, other):
+        if other.bucket_seconds != self.bucket_seconds:
+            raise ValueError(f"Cannot merge {self.bucket_seconds}s and {other.bucket_seconds}s buckets")
+        for start, total, count in other.items():
+            self.add(start, total, count)
+
+    def items(self):
+        if self.first_index is None:
+            return []
+        return [((self.first_index + i) * self.bucket_seconds, self.sums[i], int(self.counts[i]))
+                for i in range(len(self.sums)) if self.counts[i]]
+
+
+class TimeSeries:
+    # Keeps exact count, mean, variance, minimum, maximum and time span, a quantile sketch and per-interval
+    # sums, so memory does not grow with the number of samples.
+    def __init__(self, warmup_samples=0, warmup_seconds=0.0, continuation=False, bucket_seconds=BUCKET_SECONDS,
+                 relative_accuracy=RELATIVE_ACCURACY):
+        self.warmup_samples = warmup_samples
+        self.warmup_seconds = warmup_seconds
+        self.continuation = continuation
+        self.skipped = 0
+        self.first_timestamp = None
+        # A continuation cannot know whether its first samples are still in the warm-up of the part before it,
+        # so it keeps them, at most the warm-up's worth, until extend() decides.
+        self.head = []
+        self.head_closed = False
+
+        self.count = 0
+        self.total = 0.0
+        self.mean_value = 0.0
+        self.m2 = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.timed_count = 0
+        self.first_sample_time = None
+        self.last_sample_time = None
+        self.buckets = TimeBuckets(bucket_seconds)
+        self.sketch = QuantileSketch(relative_accuracy)
+        self.pending_values = array('d')
+        self.pending_timestamps = array('d')
+        self.pending_untimed = 0
+
+    def in_warmup(self, timestamp=None):
+        if self.skipped < self.warmup_samples:
+            return True
+        return bool(self.warmup_seconds) and timestamp is not None and self.first_timestamp is not None \
+            and timestamp - self.first_timestamp < self.warmup_seconds
+
+    def holds_back(self, timestamp=None):
+        if len(self.head) < self.warmup_samples:
+            return True
+        return bool(self.warmup_seconds) and timestamp is not None and self.first_timestamp is not None \
+            and timestamp - self.first_timestamp < self.warmup_seconds
+
+    def add(self, value, timestamp=None):
+        if timestamp is not None and self.first_timestamp is None:
+            self.first_timestamp = timestamp
+
+        if self.continuation:
+            if not self.head_closed and self.holds_back(timestamp):
+                self.head.append((value, timestamp))
+                return
+            self.head_closed = True
+        elif self.in_warmup(timestamp):
+            self.skipped += 1
+            return
+
+        self.record(value, timestamp)
+
+    def record(self, value, timestamp=None):
+        self.pending_values.append(value)
+        if timestamp is None:
+            self.pending_timestamps.append(math.nan)
+            self.pending_untimed += 1
+        else:
+            self.pending_timestamps.append(timestamp)
+        if len(self.pending_values) >= PENDING_SAMPLES:
+            self.flush()
+
+    def flush(self):
+        # Folding samples in batches leaves most of the per-sample work to sum(), min(), max() and sorted().
+        values, timestamps = self.pending_values, self.pending_timestamps
+        if not values:
+            return
+        count = len(values)
+        total = sum(values)
+        mean = total / count
+        deviations = list(map(sub, values, repeat(mean)))
+        ordered = sorted(values)
+        self.combine(count, total, mean, sum(map(mul, deviations, deviations)), ordered[0], ordered[-1])
+        self.sketch.add_sorted(ordered)
+
+        if self.pending_untimed:
+            timed = [(t, v) for t, v in zip(timestamps, values) if t == t]
+            timestamps = [t for t, _ in timed]
+            values = [v for _, v in timed]
+        else:
+            timestamps = timestamps.tolist()
+        if timestamps:
+            self.timed_count += len(timestamps)
+            first, last = min(timestamps), max(timestamps)
+            self.first_sample_time = first if self.first_sample_time is None else min(self.first_sample_time, first)
+            self.last_sample_time = last if self.last_sample_time is None else max(self.last_sample_time, last)
+            self.add_to_buckets(timestamps, values)
+
+        self.pending_values = array('d')
+        self.pending_timestamps = array('d')
+        self.pending_untimed = 0
+
+    def add_to_buckets(self, timestamps, values):
+        bucket_seconds = self.buckets.bucket_seconds
+        if timestamps != sorted(timestamps):
+            for timestamp, value in zip(timestamps, values):
+                self.buckets.add(timestamp, value)
+            return
+        # Log lines arrive in order, so each interval is one slice of the batch.
+        start = 0
+        while start < len(timestamps):
+            boundary = (math.floor(timestamps[start] / bucket_seconds) + 1) * bucket_seconds
+            end = bisect_left(timestamps, boundary, start)
+            self.buckets.add(timestamps[start], sum(values[start:end]), end - start)
+            start = end
+
+    def combine(self, count, total, mean, m2, minimum, maximum):
+        # Chan et al.'s pairwise update keeps the combined variance exact.
+        combined = self.count + count
+        delta = mean - self.mean_value
+        self.mean_value += delta * count / combined
+        self.m2 += m2 + delta ** 2 * self.count * count / combined
+        self.count = combined
+        self.total += total
+        self.minimum = minimum if self.minimum is None else min(self.minimum, minimum)
+        self.maximum = maximum if self.maximum is None else max(self.maximum, maximum)
+
+    def absorb(self, other):
+        self.flush()
+        other.flush()
+        if other.count:
+            self.combine(other.count, other.total, other.mean_value, other.m2, other.minimum, other.maximum)
+            self.sketch.merge(other.sketch)
+        if other.timed_count:
+            self.timed_count += other.timed_count
+            self.first_sample_time = other.first_sample_time if self.first_sample_time is None \
+                else min(self.first_sample_time, other.first_sample_time)
+            self.last_sample_time = other.last_sample_time if self.last_sample_time is None \
+                else max(self.last_sample_time, other.last_sample_time)
+            self.buckets.merge(other.buckets)
+
+    def extend(self, other):
+        # other holds the samples that directly follow this series, recorded as a continuation.
+        if self.first_timestamp is None:
+            self.first_timestamp = other.first_timestamp
+
+        for value, timestamp in other.head:
+            self.add(value, timestamp)
+        if other.count:
+            self.head_closed = True
+        self.absorb(other)
+        self.skipped += other.skipped
+
+    def merge(self, other):
+        self.absorb(other)
+        for value, timestamp in other.head:
+            self.record(value, timestamp)
+        self.skipped += other.skipped
+        if other.first_timestamp is not None:
+            if self.first_timestamp is None or other.first_timestamp < self.first_timestamp:
+                self.first_timestamp = other.first_timestamp
+
+    def resolved(self):
+        # Read on its own, a continuation has nothing before it, so its held-back samples all count.
+        self.flush()
+        if not self.head:
+            return self
+        series = TimeSeries(bucket_seconds=self.buckets.bucket_seconds, relative_accuracy=self.sketch.relative_accuracy)
+        series.absorb(self)
+        for value, timestamp in self.head:
+            series.record(value, timestamp)
+        series.flush()
+        return series
+
+    def __len__(self):
+        return self.count + len(self.pending_values) + len(self.head)
+
+    def mean(self):
+        series = self.resolved()
+        if not series.count:
+            return None
+        return series.total / series.count
+
+    def stddev(self):
+        series = self.resolved()
+        if series.count < 2:
+            return 0.0 if series.count else None
+        return math.sqrt(max(series.m2, 0.0) / (series.count - 1))
+
+    def sample_rate(self):
+        series = self.resolved()
+        if series.timed_count < 2 or series.last_sample_time <= series.first_sample_time:
+            return None
+        return (series.timed_count - 1) / (series.last_sample_time - series.first_sample_time)
+
+    def interval_means(self):
+        return [(start, total / count, count) for start, total, count in self.resolved().buckets.items()]
+
+    def summary(self):
+        series = self.resolved()
+        stats = {
+            "count": series.count,
+            "mean": series.mean(),
+            "stddev": series.stddev(),
+            "min": series.minimum,
+            "max": series.maximum,
+            "sample_rate": series.sample_rate(),
+        }
+        quantiles = series.sketch.quantiles([q / 100 for q in PERCENTILES])
+        for q, value in zip(PERCENTILES, quantiles):
+            # The exact extremes are known, so estimates never leave them.
+            stats[f"p{q}"] = None if value is None else min(max(value, series.minimum), series.maximum)
+        return stats